@@ -0,0 +1,92 @@
+"""
+Microbenchmarks of decoding a window of VK posts.
+
+Compares keeping the decoded JSON dicts with converting them to the
+slotted models of the bot, by the time of decoding, the memory the
+window holds afterwards and the peak memory of decoding with orjson.
+
+The models lower the retained memory. The peak is reached by the decoder
+and stays that of the dicts, as they are released while being converted.
+
+Usage:
+    python benchmarks/bench_models.py
+"""
+
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "vktgbot"))
+
+import models  # noqa: E402
+
+
+def make_post(post_id: int) -> dict:
+    photo = {
+        "album_id": -7,
+        "date": 1700000000,
+        "id": post_id * 10,
+        "owner_id": -1,
+        "access_key": "0123456789abcdef",
+        "sizes": [
+            {"height": 75 * i, "width": 100 * i, "type": size_type,
+             "url": f"https://sun9-1.userapi.com/impg/{post_id}/{size_type}.jpg?size=100x75&quality=96&sign=abc&type=album"}
+            for i, size_type in enumerate("smxyzwopqr", start=1)
+        ],
+        "text": "",
+        "has_tags": False,
+    }
+    return {
+        "id": post_id,
+        "from_id": -1,
+        "owner_id": -1,
+        "date": 1700000000 + post_id,
+        "marked_as_ads": 0,
+        "post_type": "post",
+        "text": "Post text with a [club1|link] " * 20,
+        "attachments": [{"type": "photo", "photo": photo} for _ in range(4)],
+        "post_source": {"type": "vk"},
+        "comments": {"can_post": 1, "count": 3},
+        "likes": {"can_like": 1, "count": 10, "user_likes": 0, "can_publish": 1},
+        "reposts": {"count": 1, "user_reposted": 0},
+        "views": {"count": 1000},
+        "is_favorite": False,
+        "hash": "abcdef0123456789",
+    }
+
+
+def decode_dicts(payload: str) -> list[dict]:
+    return models.json_loads(payload)["response"]
+
+
+def decode_models(payload: str) -> list[models.Post]:
+    return models.posts_from_vk(models.json_loads(payload)["response"])
+
+
+def retained_memory(decode, payload: str) -> tuple[int, int]:
+    tracemalloc.start()
+    window = decode(payload)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del window
+    return current, peak
+
+
+def main():
+    print(f"{'posts':>6} {'variant':>8} {'decode, ms':>11} {'retained, KiB':>14} {'peak, KiB':>10}")
+    for count in (10, 100):
+        payload = json.dumps({"response": [make_post(i) for i in range(1, count + 1)]})
+        for name, decode in (("dicts", decode_dicts), ("models", decode_models)):
+            number = max(1, 1000 // count)
+            elapsed = min(timeit.repeat(lambda: decode(payload), number=number, repeat=3))
+            current, peak = retained_memory(decode, payload)
+            print(
+                f"{count:>6} {name:>8} {elapsed / number * 1000:>11.2f} "
+                f"{current / 1024:>14.1f} {peak / 1024:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
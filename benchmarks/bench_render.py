@@ -0,0 +1,86 @@
+"""
+Microbenchmarks of rendering VK post text to Telegram HTML.
+
+Compares the current renderer with the previous implementation, which
+rescanned and rebuilt the whole text for every VK link, on plain and
+link-dense texts of growing size.
+
+Usage:
+    python benchmarks/bench_render.py
+"""
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "vktgbot"))
+
+import tools  # noqa: E402
+
+
+def legacy_render(text: str, urls: list[str]) -> str:
+    text = (
+        text
+        .replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+        .replace('"', "&quot;")
+    )
+    match = re.search(r"\[([\w.:/]+?)\|(.+?)\]", text)
+    while match:
+        left_text = text[: match.span()[0]]
+        right_text = text[match.span()[1] :]
+        matching_text = text[match.span()[0] : match.span()[1]]
+        link_domain, link_text = re.findall(r"\[(.+?)\|(.+?)\]", matching_text)[0]
+        text = left_text + f'<a href="https://vk.com/{link_domain}">{link_text}</a>' + right_text
+        match = re.search(r"\[([\w.:/]+?)\|(.+?)\]", text)
+    first_link = True
+    for url in urls:
+        if url not in text:
+            if first_link:
+                text = f'<a href="{url}"> </a>{text}\n\n{url}' if text else url
+                first_link = False
+            else:
+                text += f"\n{url}"
+    return text
+
+
+def current_render(text: str, urls: list[str]) -> str:
+    text, known_urls = tools.render_vk_text(text)
+    return tools.add_urls_to_text(text, urls, [], known_urls)
+
+
+def make_text(size: int, link_every: int) -> str:
+    words = []
+    for i in range(size):
+        if link_every and i % link_every == 0:
+            words.append(f"[id{i}|User {i}]")
+        elif i % 50 == 1:
+            words.append(f"https://example.com/{i % 20}")
+        elif i % 7 == 0:
+            words.append("R&D <b>")
+        else:
+            words.append("word")
+    return " ".join(words)
+
+
+def main():
+    urls = [f"https://example.com/{i}" for i in range(10)]
+    print(f"{'words':>8} {'links':>8} {'legacy, ms':>12} {'current, ms':>12} {'speedup':>8}")
+    for size in (100, 1000, 10000):
+        for link_every in (0, 20, 2):
+            text = make_text(size, link_every)
+            assert legacy_render(text, urls) == current_render(text, urls)
+            number = max(1, 20000 // size)
+            legacy = min(timeit.repeat(lambda: legacy_render(text, urls), number=number, repeat=3))
+            current = min(timeit.repeat(lambda: current_render(text, urls), number=number, repeat=3))
+            links = size // link_every if link_every else 0
+            print(
+                f"{size:>8} {links:>8} {legacy / number * 1000:>12.3f} "
+                f"{current / number * 1000:>12.3f} {legacy / current:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Offline check of the Long Poll mode against stand-in VK and Telegram servers.
+
+Runs `longpoll.listen` of the bot against the fake VK server of `replay.py`
+acting as a Bots Long Poll server, and the fake Telegram server, and checks
+every step of the script below. Nothing leaves the machine.
+
+Steps:
+    connect       posts published before the start are sent by the catch-up;
+    event         a `wall_post_new` event is sent at once;
+    failed 1      the new `ts` is taken and the same key is used further;
+    failed 2, 3   the bot gets a new key, and a post published without
+                  an event meanwhile is sent by the catch-up;
+    gap           an event with a post missing before it makes the bot
+                  fetch the missing post;
+    VK errors     a catch-up that can not fetch posts backs off instead of
+                  spinning, and sends them once VK recovers.
+
+Every post must reach the channel exactly once. The exit code is 1 if any
+check fails.
+
+Usage:
+    python benchmarks/longpoll_replay.py
+    python benchmarks/longpoll_replay.py --verbose
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from replay import BOT_DIR, BOT_TOKEN, FakeTelegram, FakeVK, make_fixture, make_post, start_server
+
+
+GROUP_OWNER_ID = -100
+TEXT_PATTERN = re.compile(r"Post (\d+)\.")
+
+
+class Checker:
+    def __init__(self):
+        self.failed = 0
+
+    def check(self, name: str, passed: bool, details: str = "") -> None:
+        print(f"{'PASS' if passed else 'FAIL'}  {name}{f' ({details})' if details else ''}")
+        if not passed:
+            self.failed += 1
+
+
+def make_wall_post(post_id: int) -> dict:
+    return make_post(post_id, GROUP_OWNER_ID, f"Post {post_id}.", [])
+
+
+def delivered(telegram: FakeTelegram) -> Counter:
+    """Counts the messages of every post sent to Telegram."""
+    return Counter(
+        int(match[1])
+        for message in telegram.messages
+        if (match := TEXT_PATTERN.search(message.get("text", "")))
+    )
+
+
+async def wait_until(predicate, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+async def run(args: argparse.Namespace) -> int:
+    vk = FakeVK(latency=0.01)
+    telegram = FakeTelegram(random.Random(1), 0.01, 0.0, 1, 0.0)
+    vk_runner, vk_url = await start_server(vk.app)
+    tg_runner, tg_url = await start_server(telegram.app)
+    vk.load(make_fixture([make_wall_post(post_id) for post_id in range(1, 6)], 10), vk_url)
+
+    os.environ.update({
+        "VAR_VK_API_URL": f"{vk_url}/method",
+        "VAR_VK_TOKEN": "replay",
+        "VAR_VK_DOMAIN": "",
+        "VAR_TG_BOT_TOKEN": BOT_TOKEN,
+        "VAR_STATE_DB": "./state.db",
+        "VAR_CACHE_FILE": "./cache.json",
+        "VAR_FILE_ID_INDEX_FILE": "./file_ids.json",
+        "VAR_VK_LONG_POLL_WAIT": "1",
+        "VAR_SHORT_TIME_TO_SLEEP": "1",
+        "VAR_TIME_TO_SLEEP": "4",
+        "VAR_SKIP_REPOSTS": "false",
+    })
+    sys.path.insert(0, BOT_DIR)
+
+    from aiogram import Bot
+    from aiogram.bot.api import TelegramAPIServer
+    from loguru import logger
+
+    import http_session
+    from last_id import init_ids, read_known_id
+    import longpoll
+    from sources import Source
+
+    logger.remove()
+    logger.add(sys.stderr, level="INFO" if args.verbose else "ERROR")
+
+    checker = Checker()
+    source = Source("replay", "@replay0", last_id=2)
+    init_ids(source.name, source.last_id)
+    bot = Bot(token=BOT_TOKEN, server=TelegramAPIServer.from_base(tg_url))
+    listener = asyncio.create_task(longpoll.listen(bot, source))
+    try:
+        sent = await wait_until(lambda: set(delivered(telegram)) == {3, 4, 5}, 10)
+        checker.check("connect: posts 3-5 are caught up", sent, f"sent {sorted(delivered(telegram))}")
+
+        vk.publish(make_wall_post(6))
+        sent = await wait_until(lambda: 6 in delivered(telegram), 5)
+        checker.check("event: post 6 is sent", sent)
+
+        servers_count = vk.requests["groups.getLongPollServer"]
+        vk.fail_long_poll(1)
+        new_request = (f"key{vk.long_poll_key}", str(vk.long_poll_ts))
+        used = await wait_until(lambda: new_request in vk.long_poll_requests, 5)
+        checker.check(
+            "failed 1: the new ts is used with the same key",
+            used and vk.requests["groups.getLongPollServer"] == servers_count,
+        )
+        vk.publish(make_wall_post(7))
+        sent = await wait_until(lambda: 7 in delivered(telegram), 5)
+        checker.check("failed 1: post 7 is sent", sent)
+
+        for code, post_id in ((2, 8), (3, 9)):
+            servers_count = vk.requests["groups.getLongPollServer"]
+            vk.fail_long_poll(code)
+            vk.publish(make_wall_post(post_id), event=False)
+            reconnected = await wait_until(
+                lambda: vk.requests["groups.getLongPollServer"] > servers_count, 5
+            )
+            checker.check(f"failed {code}: a new key is requested", reconnected)
+            sent = await wait_until(lambda: post_id in delivered(telegram), 5)
+            checker.check(f"failed {code}: post {post_id} published meanwhile is caught up", sent)
+
+        vk.publish(make_wall_post(10), event=False)
+        vk.publish(make_wall_post(11))
+        sent = await wait_until(lambda: {10, 11} <= set(delivered(telegram)), 5)
+        checker.check("gap: missed post 10 is fetched with post 11", sent)
+
+        vk.failing_methods.add("wall.getById")
+        fetches_count = vk.requests["wall.getById"] + vk.requests["execute"]
+        vk.publish(make_wall_post(12), event=False)
+        vk.publish(make_wall_post(13))
+        await asyncio.sleep(3)
+        fetches = vk.requests["wall.getById"] + vk.requests["execute"] - fetches_count
+        checker.check("VK errors: catch-up backs off", 0 < fetches <= 4, f"{fetches} requests in 3 s")
+        checker.check(
+            "VK errors: the window is kept",
+            read_known_id(source.name) == 11,
+            f"last known ID {read_known_id(source.name)}",
+        )
+        vk.failing_methods.clear()
+        sent = await wait_until(lambda: {12, 13} <= set(delivered(telegram)), 10)
+        checker.check("VK errors: posts 12 and 13 are sent after recovery", sent)
+
+        counts = delivered(telegram)
+        checker.check(
+            "every post is sent exactly once",
+            sorted(counts) == list(range(3, 14)) and set(counts.values()) == {1},
+            f"messages by post {dict(sorted(counts.items()))}",
+        )
+        checker.check("the listener is running", not listener.done())
+    finally:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+        await (await bot.get_session()).close()
+        await http_session.close_session()
+        await vk_runner.cleanup()
+        await tg_runner.cleanup()
+
+    print(f"{checker.failed} checks failed." if checker.failed else "All checks passed.")
+    return 1 if checker.failed else 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--verbose", action="store_true", help="show the log of the bot")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    with tempfile.TemporaryDirectory(prefix="longpoll-replay-") as workdir:
+        os.chdir(workdir)
+        exit_code = asyncio.run(run(arguments))
+    sys.exit(exit_code)
@@ -0,0 +1,787 @@
+"""
+Offline replay benchmark of the whole bot.
+
+Runs the polling loop of the bot against a local fake VK API server that
+serves fixtures of a wall, and a local fake Telegram Bot API server that
+records the calls and can answer them with flood limits (`RetryAfter`) and
+failed URL fetches (`BadRequest`). Nothing leaves the machine.
+
+Every scenario runs in its own process with its own state database, cache
+and temp folder, and reports:
+    - posts per second from the first poll to the last sent post;
+    - latency percentiles of the stages: polling of the wall, fetching of a
+      window of posts, resolving of names and videos, parsing (with document
+      downloads), downloading of a document, sending to a channel, and the
+      whole cycle of `start_script`;
+    - VK and Telegram calls per post, by method and outcome;
+    - peak RSS of the bot process.
+
+Scenarios:
+    catch_up      many short posts with photos, fetched in large windows;
+    repost_heavy  reposts of many groups and users with photos and videos;
+    doc_heavy     posts with several documents, some of them with the same title;
+    long_text     long texts with links, split into several messages.
+
+A wall recorded from VK can be replayed with `--fixture`. The file holds
+a JSON object with the raw `wall.getById` items in "posts", the group of
+the wall in "group", and optionally "groups", "users" and "videos" as
+returned by `groups.getById`, `users.get` and `video.get`, and the
+window size in "req_count". URLs of photos and documents are served by
+the fake VK server.
+
+The Telegram rate limits of the bot are lifted unless `VAR_TG_GLOBAL_RATE`,
+`VAR_TG_CHAT_RATE` or `VAR_TG_CHAT_BURST` are set in the environment.
+
+Usage:
+    python benchmarks/replay.py
+    python benchmarks/replay.py --scenario doc_heavy --channels 3
+    python benchmarks/replay.py --retry-after-rate 0.02 --bad-request-rate 0.05
+    python benchmarks/replay.py --fixture wall.json --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+BOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "vktgbot")
+BOT_TOKEN = "123456:replay"
+GROUP_ID = 100
+BASE_DATE = 1700000000
+PHOTO_SIZE = 32768
+
+WORDS = (
+    "the", "bot", "post", "wall", "channel", "news", "update", "release", "photo",
+    "community", "event", "today", "tomorrow", "meeting", "ticket", "concert",
+    "новости", "сегодня", "встреча", "концерт", "билеты", "фото", "группа", "пост",
+)
+DOC_TITLES = ("document.pdf", "schedule.pdf", "price.xlsx", "rules.docx", "photo.zip")
+
+
+def make_text(rng: random.Random, length: int, link_rate: float = 0.05) -> str:
+    paragraphs = []
+    size = 0
+    while size < length:
+        sentences = []
+        for _ in range(rng.randint(2, 6)):
+            words = []
+            for _ in range(rng.randint(5, 18)):
+                roll = rng.random()
+                if roll < link_rate / 2:
+                    words.append(f"[club{rng.randint(1, 500)}|{rng.choice(WORDS)}]")
+                elif roll < link_rate:
+                    words.append(f"https://example.com/{rng.choice(WORDS)}/{rng.randint(1, 10**6)}")
+                else:
+                    words.append(rng.choice(WORDS))
+            sentences.append(" ".join(words).capitalize() + rng.choice(".!?"))
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+
+def make_photo(owner_id: int, photo_id: int) -> dict:
+    return {
+        "type": "photo",
+        "photo": {
+            "id": photo_id,
+            "owner_id": owner_id,
+            "album_id": -7,
+            "date": BASE_DATE,
+            "access_key": "0123456789abcdef",
+            "sizes": [
+                {"type": size_type, "width": 100 * scale, "height": 75 * scale, "url": ""}
+                for scale, size_type in enumerate("smxyzw", start=1)
+            ],
+        },
+    }
+
+
+def make_doc(owner_id: int, doc_id: int, title: str, size: int) -> dict:
+    return {
+        "type": "doc",
+        "doc": {
+            "id": doc_id,
+            "owner_id": owner_id,
+            "title": title,
+            "size": size,
+            "ext": title.rsplit(".", 1)[-1],
+            "url": "",
+        },
+    }
+
+
+def make_video(owner_id: int, video_id: int) -> dict:
+    return {"type": "video", "video": {"id": video_id, "owner_id": owner_id, "type": "video"}}
+
+
+def make_link(url: str) -> dict:
+    return {"type": "link", "link": {"url": url, "title": "Link"}}
+
+
+def make_post(post_id: int, owner_id: int, text: str, attachments: list, **fields) -> dict:
+    return {
+        "id": post_id,
+        "owner_id": owner_id,
+        "from_id": owner_id,
+        "date": BASE_DATE + post_id * 60,
+        "post_type": "post",
+        "text": text,
+        "attachments": attachments,
+        "post_source": {"type": "vk"},
+        "comments": {"count": 0},
+        "likes": {"count": 0},
+        "views": {"count": 0},
+        **fields,
+    }
+
+
+def make_fixture(posts: list[dict], req_count: int, **extra) -> dict:
+    return {
+        "group": {"id": GROUP_ID, "name": "Replay", "screen_name": "replay"},
+        "req_count": req_count,
+        "posts": posts,
+        **extra,
+    }
+
+
+def catch_up(rng: random.Random) -> dict:
+    owner_id = -GROUP_ID
+    posts = []
+    for post_id in range(1, 361):
+        # Some IDs are missing from the wall, as deleted posts are.
+        if post_id % 17 == 0:
+            continue
+        attachments = [make_photo(owner_id, post_id * 10 + index) for index in range(rng.randint(0, 4))]
+        if rng.random() < 0.2:
+            attachments.append(make_link(f"https://example.com/article/{post_id}"))
+        posts.append(make_post(post_id, owner_id, make_text(rng, rng.randint(100, 700)), attachments))
+    return make_fixture(posts, 50)
+
+
+def repost_heavy(rng: random.Random) -> dict:
+    owner_id = -GROUP_ID
+    groups = [{"id": 1000 + index, "name": f"Group {index}", "screen_name": f"group{index}"} for index in range(30)]
+    users = [{"id": 5000 + index, "first_name": "User", "last_name": str(index)} for index in range(30)]
+    videos = []
+    posts = []
+    for post_id in range(1, 151):
+        copy_history = []
+        if rng.random() < 0.8:
+            if rng.random() < 0.5:
+                repost_owner = -rng.choice(groups)["id"]
+            else:
+                repost_owner = rng.choice(users)["id"]
+            attachments = [make_photo(repost_owner, post_id * 10 + index) for index in range(rng.randint(0, 3))]
+            for index in range(rng.randint(0, 2)):
+                video_id = post_id * 10 + index
+                attachments.append(make_video(repost_owner, video_id))
+                video = {"id": video_id, "owner_id": repost_owner, "title": "Video"}
+                if rng.random() < 0.5:
+                    video["files"] = {"external": f"https://youtube.com/watch?v={post_id}_{index}"}
+                videos.append(video)
+            copy_history.append(
+                make_post(rng.randint(1, 10**5), repost_owner, make_text(rng, rng.randint(100, 900)), attachments)
+            )
+        posts.append(make_post(
+            post_id, owner_id, make_text(rng, rng.randint(0, 150)), [], copy_history=copy_history
+        ))
+    return make_fixture(posts, 25, groups=groups, users=users, videos=videos)
+
+
+def doc_heavy(rng: random.Random) -> dict:
+    owner_id = -GROUP_ID
+    posts = []
+    for post_id in range(1, 41):
+        attachments = []
+        for index in range(rng.randint(1, 6)):
+            if rng.random() < 0.05:
+                size = 30 * 2**20  # too large to be uploaded, sent as a link
+            else:
+                size = rng.randint(10 * 2**10, 2 * 2**20)
+            attachments.append(make_doc(owner_id, post_id * 10 + index, rng.choice(DOC_TITLES), size))
+        posts.append(make_post(post_id, owner_id, make_text(rng, rng.randint(50, 300)), attachments))
+    return make_fixture(posts, 10)
+
+
+def long_text(rng: random.Random) -> dict:
+    owner_id = -GROUP_ID
+    posts = []
+    for post_id in range(1, 81):
+        roll = rng.random()
+        photos_count = 0 if roll < 0.5 else 1 if roll < 0.8 else 3
+        attachments = [make_photo(owner_id, post_id * 10 + index) for index in range(photos_count)]
+        posts.append(make_post(
+            post_id, owner_id, make_text(rng, rng.randint(2000, 15000), link_rate=0.08), attachments
+        ))
+    return make_fixture(posts, 20)
+
+
+SCENARIOS = {
+    "catch_up": catch_up,
+    "repost_heavy": repost_heavy,
+    "doc_heavy": doc_heavy,
+    "long_text": long_text,
+}
+
+
+def localize_post(post: dict, base_url: str) -> None:
+    """Points URLs of photos and documents of the post to the fake VK server."""
+    for attachment in post.get("attachments", ()):
+        if attachment["type"] == "photo":
+            photo = attachment["photo"]
+            for size in photo.get("sizes", ()):
+                size["url"] = f"{base_url}/files/photo/{photo['owner_id']}_{photo['id']}_{size['type']}.jpg"
+        elif attachment["type"] == "doc":
+            doc = attachment["doc"]
+            doc["url"] = f"{base_url}/files/doc/{doc['owner_id']}_{doc['id']}?size={doc['size']}"
+    for repost in post.get("copy_history", ()):
+        localize_post(repost, base_url)
+
+
+class VKError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.error = {"error_code": code, "error_msg": message}
+
+
+class FakeVK:
+    """Fake VK API serving the wall of the fixture, with the files of its posts.
+
+    It is also a Bots Long Poll server: `publish` adds a post to the wall
+    with its `wall_post_new` event, and `fail_long_poll` answers the next
+    `a_check` request with a `failed` code. Methods listed in `failing_methods`
+    return an error.
+
+    Args:
+        latency (float): Time (in seconds) every request takes.
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.requests = Counter()
+        self.calls = Counter()
+        self.fixture: dict = {}
+        self.base_url = ""
+        self.failing_methods: set[str] = set()
+        self.long_poll_key = 0
+        self.long_poll_ts = 0
+        self.long_poll_requests: list[tuple[str, str]] = []
+        self.long_poll_responses: asyncio.Queue = asyncio.Queue()
+        self.app = web.Application()
+        self.app.router.add_route("*", "/method/{method}", self.handle_method)
+        self.app.router.add_get("/files/doc/{name}", self.handle_doc)
+        self.app.router.add_get("/files/photo/{name}", self.handle_photo)
+        self.app.router.add_get("/longpoll", self.handle_long_poll)
+
+    def load(self, fixture: dict, base_url: str) -> None:
+        for post in fixture["posts"]:
+            localize_post(post, base_url)
+        self.fixture = fixture
+        self.base_url = base_url
+        self.posts = {f"{post['owner_id']}_{post['id']}": post for post in fixture["posts"]}
+        self.groups = {group["id"]: group for group in [fixture["group"], *fixture.get("groups", [])]}
+        self.users = {user["id"]: user for user in fixture.get("users", [])}
+        self.videos = {f"{video['owner_id']}_{video['id']}": video for video in fixture.get("videos", [])}
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(request.query)
+        if request.method == "POST":
+            params.update(await request.post())
+        self.requests[method] += 1
+        await asyncio.sleep(self.latency)
+
+        if method == "execute":
+            results, errors = [], []
+            for call_method, call_params in parse_execute_code(params["code"]):
+                try:
+                    results.append(self.call(call_method, call_params))
+                except VKError as ex:
+                    results.append(False)
+                    errors.append(ex.error)
+            body = {"response": results}
+            if errors:
+                body["execute_errors"] = errors
+            return web.json_response(body)
+
+        try:
+            return web.json_response({"response": self.call(method, params)})
+        except VKError as ex:
+            return web.json_response({"error": ex.error})
+
+    def publish(self, post: dict, event: bool = True) -> None:
+        """Adds the post to the wall and, if `event` is set, sends its `wall_post_new` event."""
+        localize_post(post, self.base_url)
+        self.fixture["posts"].append(post)
+        self.posts[f"{post['owner_id']}_{post['id']}"] = post
+        if event:
+            self.long_poll_ts += 1
+            self.long_poll_responses.put_nowait({
+                "ts": str(self.long_poll_ts),
+                "updates": [{"type": "wall_post_new", "object": post, "group_id": GROUP_ID}],
+            })
+
+    def fail_long_poll(self, code: int) -> None:
+        """Answers the next `a_check` request with the `failed` code.
+
+        Code 1 moves `ts` forward, codes 2 and 3 invalidate the key.
+        """
+        if code == 1:
+            self.long_poll_ts += 10
+            self.long_poll_responses.put_nowait({"failed": 1, "ts": str(self.long_poll_ts)})
+        else:
+            self.long_poll_responses.put_nowait({"failed": code})
+
+    async def handle_long_poll(self, request: web.Request) -> web.Response:
+        key, ts = request.query["key"], request.query["ts"]
+        self.long_poll_requests.append((key, ts))
+        if key != f"key{self.long_poll_key}":
+            return web.json_response({"failed": 2})
+        try:
+            body = await asyncio.wait_for(
+                self.long_poll_responses.get(), float(request.query.get("wait", 25))
+            )
+        except asyncio.TimeoutError:
+            body = {"ts": str(self.long_poll_ts), "updates": []}
+        if body.get("failed", 1) != 1:
+            self.long_poll_key += 1
+        return web.json_response(body)
+
+    def call(self, method: str, params: dict):
+        try:
+            if method in self.failing_methods:
+                raise VKError(10, "Internal server error")
+            result = self.run(method, params)
+        except VKError:
+            self.calls[(method, "error")] += 1
+            raise
+        self.calls[(method, "ok")] += 1
+        return result
+
+    def run(self, method: str, params: dict):
+        if method == "wall.get":
+            items = sorted(self.fixture["posts"], key=lambda post: post["id"], reverse=True)
+            return {"count": len(items), "items": items[:int(params.get("count", 20))]}
+        if method == "wall.getById":
+            keys = str(params["posts"]).split(",")
+            return [self.posts[key] for key in keys if key in self.posts]
+        if method == "groups.getById":
+            requested = str(params.get("group_ids") or params.get("group_id", "")).split(",")
+            groups = []
+            for group_key in requested:
+                for group in self.groups.values():
+                    if group_key in (str(group["id"]), group.get("screen_name")):
+                        groups.append(group)
+                        break
+            if not groups:
+                raise VKError(100, "One of the parameters specified was missing or invalid: group_ids")
+            return groups
+        if method == "groups.getLongPollServer":
+            self.long_poll_key += 1
+            return {
+                "key": f"key{self.long_poll_key}",
+                "server": f"{self.base_url}/longpoll",
+                "ts": str(self.long_poll_ts),
+            }
+        if method == "users.get":
+            return [
+                self.users[int(user_id)] for user_id in str(params["user_ids"]).split(",")
+                if int(user_id) in self.users
+            ]
+        if method == "video.get":
+            items = []
+            for key in str(params["videos"]).split(","):
+                video = self.videos.get("_".join(key.split("_")[:2]))
+                if video:
+                    items.append(video)
+            return {"count": len(items), "items": items}
+        raise VKError(3, f"Unknown method passed: {method}")
+
+    async def handle_doc(self, request: web.Request) -> web.StreamResponse:
+        size = int(request.query.get("size", 0))
+        response = web.StreamResponse(headers={"Content-Length": str(size)})
+        await response.prepare(request)
+        chunk = b"\0" * 65536
+        while size > 0:
+            await response.write(chunk[:size])
+            size -= len(chunk)
+        await response.write_eof()
+        return response
+
+    async def handle_photo(self, request: web.Request) -> web.Response:
+        return web.Response(body=b"\xff\xd8" + b"\0" * PHOTO_SIZE, content_type="image/jpeg")
+
+
+def parse_execute_code(code: str) -> list[tuple[str, dict]]:
+    """Splits the code of `execute` made by the bot, `return [API.method({...}),...];`, into calls."""
+    decoder = json.JSONDecoder()
+    calls = []
+    position = 0
+    while (start := code.find("API.", position)) != -1:
+        paren = code.index("(", start)
+        params, end = decoder.raw_decode(code, paren + 1)
+        calls.append((code[start + len("API."):paren], params))
+        position = end + 1
+    return calls
+
+
+class FakeTelegram:
+    """Fake Telegram Bot API that records the calls of the bot.
+
+    Calls are answered with a flood limit with the probability `retry_after_rate`.
+    Photos sent by URL fail to be fetched with the probability `bad_request_rate`.
+
+    Args:
+        rng (random.Random): Random generator of the injected errors.
+        latency (float): Time (in seconds) every call takes.
+        retry_after_rate (float): Probability of `RetryAfter`.
+        retry_after (int): Seconds the flood limit lasts.
+        bad_request_rate (float): Probability of `BadRequest` for photos sent by URL.
+    """
+
+    def __init__(
+        self,
+        rng: random.Random,
+        latency: float,
+        retry_after_rate: float,
+        retry_after: int,
+        bad_request_rate: float
+    ):
+        self.rng = rng
+        self.latency = latency
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.bad_request_rate = bad_request_rate
+        self.calls = Counter()
+        self.messages: list[dict] = []
+        self.uploaded_bytes = 0
+        self.message_id = 0
+        self.file_id = 0
+        self.app = web.Application(client_max_size=64 * 2**20)
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        form = await request.post()
+        await asyncio.sleep(self.latency)
+        fields = {}
+        for name, value in form.items():
+            if isinstance(value, web.FileField):
+                self.uploaded_bytes += len(value.file.read())
+                fields[name] = f"attach://{name}"
+            else:
+                fields[name] = value
+
+        if self.rng.random() < self.retry_after_rate:
+            self.calls[(method, "retry_after")] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        if self.photo_urls(method, fields) and self.rng.random() < self.bad_request_rate:
+            self.calls[(method, "bad_request")] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 400,
+                "description": "Bad Request: failed to get HTTP URL content",
+            }, status=400)
+
+        self.calls[(method, "ok")] += 1
+        chat = fields.get("chat_id", "")
+        if method == "sendMessage":
+            result = self.message(chat, text=fields.get("text", ""))
+        elif method == "sendPhoto":
+            result = self.message(chat, photo=[self.photo(fields["photo"])])
+        elif method == "sendDocument":
+            result = self.message(chat, document=self.document(fields["document"]))
+        elif method == "sendMediaGroup":
+            result = [
+                self.message(chat, photo=[self.photo(item["media"])]) if item["type"] == "photo"
+                else self.message(chat, document=self.document(item["media"]))
+                for item in json.loads(fields["media"])
+            ]
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def photo_urls(method: str, fields: dict) -> bool:
+        if method == "sendPhoto":
+            return fields.get("photo", "").startswith("http")
+        if method == "sendMediaGroup":
+            return any(
+                item["type"] == "photo" and item["media"].startswith("http")
+                for item in json.loads(fields["media"])
+            )
+        return False
+
+    def message(self, chat: str, **content) -> dict:
+        self.message_id += 1
+        message = {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": -1000000000000 - abs(hash(chat)) % 10**6, "type": "channel", "title": chat},
+            **content,
+        }
+        self.messages.append(message)
+        return message
+
+    def new_file_id(self, source: str) -> str:
+        # A file_id sent by the bot is kept, anything else is a new file.
+        if source.startswith(("http", "attach://")):
+            self.file_id += 1
+            return f"file{self.file_id}"
+        return source
+
+    def photo(self, source: str) -> dict:
+        file_id = self.new_file_id(source)
+        return {"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 960}
+
+    def document(self, source: str) -> dict:
+        file_id = self.new_file_id(source)
+        return {"file_id": file_id, "file_unique_id": file_id, "file_name": "document"}
+
+
+async def start_server(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    await web.SockSite(runner, sock).start()
+    return runner, f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def timed(module, name: str, stage: str, timings: dict[str, list[float]]) -> None:
+    """Replaces the coroutine function of the module with one recording its durations."""
+    function = getattr(module, name)
+
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await function(*args, **kwargs)
+        finally:
+            timings[stage].append(time.perf_counter() - started)
+
+    setattr(module, name, wrapper)
+
+
+async def replay(fixture_path: str, vk_url: str, tg_url: str, channels: int, verbose: bool) -> dict:
+    """Runs the polling loop of the bot over the whole wall of the fixture in this process."""
+    os.environ.update({
+        "VAR_VK_API_URL": f"{vk_url}/method",
+        "VAR_VK_TOKEN": "replay",
+        "VAR_VK_DOMAIN": "",
+        "VAR_TG_BOT_TOKEN": BOT_TOKEN,
+        "VAR_STATE_DB": "./state.db",
+        "VAR_CACHE_FILE": "./cache.json",
+        "VAR_FILE_ID_INDEX_FILE": "./file_ids.json",
+    })
+    # An unset VAR_SKIP_REPOSTS reads as true in config, so reposts are enabled explicitly.
+    os.environ.setdefault("VAR_SKIP_REPOSTS", "false")
+    os.environ.setdefault("VAR_TG_GLOBAL_RATE", "1000000")
+    os.environ.setdefault("VAR_TG_CHAT_RATE", "1000000")
+    os.environ.setdefault("VAR_TG_CHAT_BURST", "1000000")
+    sys.path.insert(0, BOT_DIR)
+
+    from aiogram import Bot
+    from aiogram.bot.api import TelegramAPIServer
+    from loguru import logger
+
+    import api_requests
+    from cache import save_caches
+    import http_session
+    from last_id import init_ids, read_id, read_known_id, read_post_status
+    import parse_posts
+    from sources import Source
+    import start_script
+    from workspace import temp_workspace
+
+    logger.remove()
+    logger.add(sys.stderr, level="INFO" if verbose else "ERROR")
+
+    timings: dict[str, list[float]] = defaultdict(list)
+    timed(api_requests, "get_last_id", "vk_poll", timings)
+    timed(api_requests, "get_data_from_vk", "vk_fetch", timings)
+    timed(start_script, "resolve_window", "resolve", timings)
+    timed(start_script, "parse_post", "parse", timings)
+    timed(parse_posts, "get_doc", "doc_download", timings)
+    timed(start_script, "send_post", "send", timings)
+
+    with open(fixture_path, "r", encoding="utf-8") as file:
+        fixture = json.load(file)
+    post_ids = sorted(post["id"] for post in fixture["posts"])
+    source = Source(
+        fixture["group"]["screen_name"],
+        [f"@replay{index}" for index in range(channels)],
+        req_count=fixture.get("req_count", 20),
+        last_id=post_ids[0] - 1,
+    )
+    init_ids(source.name, source.last_id)
+
+    bot = Bot(token=BOT_TOKEN, server=TelegramAPIServer.from_base(tg_url))
+    started = time.perf_counter()
+    try:
+        while True:
+            cycle_started = time.perf_counter()
+            exit_code = await start_script.start_script(bot, source)
+            temp_workspace.sweep(source.temp_folder)
+            save_caches()
+            timings["cycle"].append(time.perf_counter() - cycle_started)
+            if exit_code != 1 and read_known_id(source.name) >= read_id(source.name):
+                break
+    finally:
+        await (await bot.get_session()).close()
+        await http_session.close_session()
+    duration = time.perf_counter() - started
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "posts": len(post_ids),
+        "sent": sum(read_post_status(source.name, post_id, "post") == "sent" for post_id in post_ids),
+        "duration": duration,
+        "timings": timings,
+        # Bytes on macOS, kilobytes elsewhere.
+        "peak_rss": peak_rss if sys.platform == "darwin" else peak_rss * 1024,
+    }
+
+
+async def run_scenario(name: str, fixture: dict, args: argparse.Namespace) -> dict:
+    """Runs the scenario in a new process against fake servers of this one."""
+    rng = random.Random(args.seed)
+    vk = FakeVK(args.vk_latency)
+    telegram = FakeTelegram(
+        rng, args.tg_latency, args.retry_after_rate, args.retry_after, args.bad_request_rate
+    )
+    vk_runner, vk_url = await start_server(vk.app)
+    tg_runner, tg_url = await start_server(telegram.app)
+    vk.load(fixture, vk_url)
+    try:
+        with tempfile.TemporaryDirectory(prefix=f"replay-{name}-") as workdir:
+            fixture_path = os.path.join(workdir, "fixture.json")
+            result_path = os.path.join(workdir, "result.json")
+            with open(fixture_path, "w", encoding="utf-8") as file:
+                json.dump(fixture, file, ensure_ascii=False)
+            command = [
+                sys.executable, os.path.abspath(__file__), "--child",
+                "--fixture", fixture_path, "--result", result_path,
+                "--vk-url", vk_url, "--tg-url", tg_url,
+                "--channels", str(args.channels),
+            ]
+            if args.verbose:
+                command.append("--verbose")
+            process = await asyncio.create_subprocess_exec(*command, cwd=workdir)
+            if await process.wait() != 0:
+                raise RuntimeError(f"Scenario {name} failed with exit code {process.returncode}.")
+            with open(result_path, "r", encoding="utf-8") as file:
+                result = json.load(file)
+    finally:
+        await vk_runner.cleanup()
+        await tg_runner.cleanup()
+
+    result["scenario"] = name
+    result["vk_requests"] = dict(vk.requests)
+    result["vk_calls"] = {f"{method} {outcome}": count for (method, outcome), count in vk.calls.items()}
+    result["tg_calls"] = {f"{method} {outcome}": count for (method, outcome), count in telegram.calls.items()}
+    result["tg_uploaded_bytes"] = telegram.uploaded_bytes
+    return result
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def print_report(result: dict) -> None:
+    posts = result["posts"]
+    print(
+        f"{result['scenario']}: {result['sent']}/{posts} posts sent in {result['duration']:.2f} s, "
+        f"{posts / result['duration']:.1f} posts/s, peak RSS {result['peak_rss'] / 2**20:.1f} MB"
+    )
+    vk_requests = sum(result["vk_requests"].values())
+    vk_calls = sum(result["vk_calls"].values())
+    tg_calls = sum(result["tg_calls"].values())
+    print(
+        f"  VK: {vk_requests} requests ({vk_requests / posts:.2f}/post), "
+        f"{vk_calls} method calls ({vk_calls / posts:.2f}/post)"
+    )
+    for key, count in sorted(result["vk_calls"].items()):
+        print(f"    {key:<28}{count:>8}")
+    print(
+        f"  Telegram: {tg_calls} calls ({tg_calls / posts:.2f}/post), "
+        f"{result['tg_uploaded_bytes'] / 2**20:.1f} MB uploaded"
+    )
+    for key, count in sorted(result["tg_calls"].items()):
+        print(f"    {key:<28}{count:>8}")
+    print(f"  {'stage':<14}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, values in result["timings"].items():
+        print(
+            f"  {stage:<14}{len(values):>7}"
+            + "".join(f"{percentile(values, fraction) * 1000:>10.1f}" for fraction in (0.5, 0.95, 0.99))
+            + f"{max(values) * 1000:>10.1f}"
+        )
+    print()
+
+
+async def run(args: argparse.Namespace) -> None:
+    if args.fixture:
+        with open(args.fixture, "r", encoding="utf-8") as file:
+            fixtures = {os.path.basename(args.fixture): json.load(file)}
+    else:
+        names = args.scenario or list(SCENARIOS)
+        fixtures = {name: SCENARIOS[name](random.Random(args.seed)) for name in names}
+
+    results = []
+    for name, fixture in fixtures.items():
+        result = await run_scenario(name, fixture, args)
+        print_report(result)
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                        help="scenario to run, can be repeated; all scenarios by default")
+    parser.add_argument("--fixture", help="JSON file with a recorded wall to replay instead of the scenarios")
+    parser.add_argument("--channels", type=int, default=1, help="number of Telegram channels of the source")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the fixtures and of the injected errors")
+    parser.add_argument("--vk-latency", type=float, default=0.02, help="seconds every VK request takes")
+    parser.add_argument("--tg-latency", type=float, default=0.05, help="seconds every Telegram call takes")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="probability of RetryAfter")
+    parser.add_argument("--retry-after", type=int, default=1, help="seconds of injected flood limits")
+    parser.add_argument("--bad-request-rate", type=float, default=0.0,
+                        help="probability of BadRequest for photos sent by URL")
+    parser.add_argument("--output", help="file to write the results to as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the log of the bot")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    parser.add_argument("--vk-url", help=argparse.SUPPRESS)
+    parser.add_argument("--tg-url", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.child:
+        child_result = asyncio.run(replay(
+            arguments.fixture, arguments.vk_url, arguments.tg_url, arguments.channels, arguments.verbose
+        ))
+        with open(arguments.result, "w", encoding="utf-8") as result_file:
+            json.dump(child_result, result_file)
+    else:
+        asyncio.run(run(arguments))
@@ -0,0 +1,36 @@
+import pytest
+
+from keyword_filter import KeywordFilter
+
+
+def test_strings_words_and_regexes_are_found():
+    keyword_filter = KeywordFilter(["sale", {"word": "ad"}, {"regex": r"\d+%"}])
+    assert keyword_filter.search("Big SALE today") == "sale"
+    assert keyword_filter.search("An ad here") == "ad"
+    assert keyword_filter.search("Read it") is None
+    assert keyword_filter.search("Minus 50%") == r"\d+%"
+
+
+def test_earliest_regex_match_is_returned():
+    rules = [{"regex": "world"}, {"regex": "hel+o"}]
+    assert KeywordFilter(rules).search("Hello, world") == "hel+o"
+
+
+def test_regexes_with_groups_are_matched_on_their_own():
+    rules = [{"regex": "(b)x"}, {"regex": r"(a)\1"}, {"regex": "(?P<name>z)(?P=name)"}, {"regex": "(?s)q.r"}]
+    keyword_filter = KeywordFilter(rules)
+    assert keyword_filter.pattern is None
+    assert keyword_filter.search("xx AA") == r"(a)\1"
+    assert keyword_filter.search("zz bx") == "(?P<name>z)(?P=name)"
+    assert keyword_filter.search("q\nr") == "(?s)q.r"
+    assert keyword_filter.search("ab") is None
+
+
+def test_regexes_with_repeated_group_names_are_matched_on_their_own():
+    keyword_filter = KeywordFilter([{"regex": "(?P<n>a)b"}, {"regex": "(?P<n>c)d"}])
+    assert keyword_filter.search("xcd") == "(?P<n>c)d"
+
+
+def test_incorrect_regex_names_the_rule():
+    with pytest.raises(ValueError, match=r"\(a\)\\\\2"):
+        KeywordFilter([{"regex": r"(a)\2"}])
@@ -0,0 +1,91 @@
+from message_plan import (
+    CAPTION_LIMIT,
+    CONTINUATION_END,
+    CONTINUATION_START,
+    MEDIA_GROUP_LIMIT,
+    MESSAGE_LIMIT,
+    plan_messages,
+    split_html,
+    visible_length,
+)
+
+
+def make_photos(count: int) -> list[dict]:
+    return [{"url": f"https://example.com/{index}.jpg"} for index in range(count)]
+
+
+def test_short_text_is_not_split():
+    assert split_html("Hello, <b>world</b>!") == ["Hello, <b>world</b>!"]
+    assert split_html("") == []
+
+
+def test_whitespace_over_the_limit_gives_one_unmarked_part():
+    text = "b" * 4000 + "\n" * 100
+    assert split_html(text) == ["b" * 4000]
+
+
+def test_long_text_is_split_with_continuation_marks():
+    text = " ".join(["word"] * 2000)
+    parts = split_html(text)
+    assert len(parts) == 3
+    assert all(visible_length(part) <= MESSAGE_LIMIT for part in parts)
+    assert parts[0].endswith(CONTINUATION_END)
+    assert parts[1].startswith(CONTINUATION_START) and parts[1].endswith(CONTINUATION_END)
+    assert parts[-1].startswith(CONTINUATION_START)
+
+
+def test_tags_are_reopened_across_a_split():
+    text = '<a href="https://example.com">' + "link " * 100 + "</a>"
+    parts = split_html(text, limit=200)
+    assert len(parts) > 1
+    for part in parts:
+        assert part.count("<a ") == part.count("</a>") == 1
+    assert all('<a href="https://example.com">' in part for part in parts[1:])
+
+
+def test_lengths_are_counted_in_utf16_units():
+    assert visible_length("😀") == 2
+    assert visible_length("<b>ab</b>&amp;") == 3
+    text = "😀 " * 1500
+    parts = split_html(text)
+    assert len(parts) == 2
+    assert all(visible_length(part) <= MESSAGE_LIMIT for part in parts)
+
+
+def test_text_without_media_is_sent_as_messages():
+    plan = plan_messages("word " * 1000, [], [])
+    assert [message.method for message in plan] == ["message", "message"]
+
+
+def test_caption_goes_on_the_first_media_group_only():
+    plan = plan_messages("Caption", make_photos(12), [])
+    assert [message.method for message in plan] == ["media_group", "media_group"]
+    assert plan[0].text == "Caption"
+    assert plan[1].text == ""
+
+
+def test_text_over_the_caption_limit_is_sent_before_the_media():
+    text = "word " * 300
+    plan = plan_messages(text, make_photos(2), [])
+    assert [message.method for message in plan] == ["message", "media_group"]
+    assert visible_length(text) > CAPTION_LIMIT
+    assert plan[1].text == ""
+
+
+def test_media_are_chunked_into_groups():
+    plan = plan_messages("", make_photos(21), [{"url": "doc"}])
+    assert [(message.method, len(message.media)) for message in plan] == [
+        ("media_group", MEDIA_GROUP_LIMIT),
+        ("media_group", MEDIA_GROUP_LIMIT),
+        ("photo", 1),
+        ("document", 1),
+    ]
+    assert [message.media_type for message in plan] == ["photo", "photo", "photo", "document"]
+
+
+def test_single_photo_with_long_text_is_a_preview():
+    photos = make_photos(1)
+    plan = plan_messages("word " * 300, photos, [])
+    assert len(plan) == 1
+    assert plan[0].method == "message"
+    assert plan[0].text.startswith(f'<a href="{photos[0]["url"]}"> </a>')
@@ -0,0 +1,25 @@
+import time
+
+from tools import render_vk_text
+
+
+def test_vk_links_are_rendered():
+    text, known_urls = render_vk_text("Hi [id1|Pavel] and [club2|the club]!")
+    assert text == 'Hi <a href="https://vk.com/id1">Pavel</a> and <a href="https://vk.com/club2">the club</a>!'
+    assert known_urls == {"https://vk.com/id1", "https://vk.com/club2"}
+
+
+def test_unclosed_vk_links_are_left_as_is():
+    text, _ = render_vk_text("[id1|Pavel\nDurov] [id2|Nikolai")
+    assert text == "[id1|Pavel\nDurov] [id2|Nikolai"
+
+
+def test_many_unclosed_vk_links_are_rendered_in_linear_time():
+    started = time.perf_counter()
+    render_vk_text("[a|x " * 8000)
+    assert time.perf_counter() - started < 0.5
+
+
+def test_trailing_punctuation_is_not_part_of_known_urls():
+    _, known_urls = render_vk_text("See https://example.com/a?b=1&c=2. Or (https://example.com/d)!")
+    assert known_urls == {"https://example.com/a?b=1&c=2", "https://example.com/d"}
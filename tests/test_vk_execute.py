@@ -0,0 +1,27 @@
+from vk_execute import split_execute_response
+
+
+def test_responses_are_split_by_call():
+    data = {"response": [[1], {"count": 0}, []]}
+    assert split_execute_response(data, 3) == [
+        {"response": [1]},
+        {"response": {"count": 0}},
+        {"response": []},
+    ]
+
+
+def test_failed_calls_get_their_errors():
+    data = {
+        "response": [False, [1], None],
+        "execute_errors": [{"error_code": 15, "error_msg": "Access denied"}],
+    }
+    results = split_execute_response(data, 4)
+    assert results[0] == {"error": {"error_code": 15, "error_msg": "Access denied"}}
+    assert results[1] == {"response": [1]}
+    assert "error_msg" in results[2]["error"]
+    assert "error_msg" in results[3]["error"]
+
+
+def test_error_of_execute_is_returned_for_every_call():
+    data = {"error": {"error_code": 5, "error_msg": "User authorization failed"}}
+    assert split_execute_response(data, 2) == [data, data]
@@ -6,17 +6,33 @@ v3.1
 by @alcortazzo
 """
 
+import asyncio
+import math
+import sqlite3
 import sys
 import time
 
+from aiogram import Bot
 from loguru import logger
 
-from config import SINGLE_START, TIME_TO_SLEEP, SHORT_TIME_TO_SLEEP
-from start_script import start_script
+from cache import file_id_index, save_caches, vk_cache
+from config import (
+    SINGLE_START, TIME_TO_SLEEP, SHORT_TIME_TO_SLEEP, ADAPTIVE_SLEEP, TG_BOT_TOKEN, VK_LONG_POLL,
+    WORKER_MODE, WORKER_ID, LEASE_TTL
+)
+from last_id import init_ids
+from metrics import metrics, export as export_metrics
+from profiling import profiler, install_signal_handlers
+from sources import Source, load_sources
+from start_script import start_script, update_backlog
+import http_session
+import leases
+import longpoll
 import tools
+from workspace import temp_workspace
 
 logger.add(
-    "./logs/debug.log",
+    f"./logs/debug-{WORKER_ID}.log" if WORKER_MODE else "./logs/debug.log",
     format="{time} {level} {message}",
     level="DEBUG",
     rotation="1 week",
@@ -28,25 +44,159 @@ logger.info("Script is started.")
 
 
 @logger.catch(reraise=True)
-def main():
-    exit_code = start_script()
-    tools.prepare_temp_folder()
+async def main(bot: Bot, source: Source):
+    with profiler.cycle(), metrics.time("vktgbot_cycle_seconds", source=source.name):
+        exit_code = await start_script(bot, source)
+    update_backlog(source)
+    temp_workspace.sweep(source.temp_folder)
+    save_caches()
+    logger.debug(f"VK cache stats: {vk_cache.stats()}")
+    logger.debug(f"File ID index stats: {file_id_index.stats()}")
     return exit_code
 
-if __name__ == "__main__":
-    while True:
+
+async def run_source(bot: Bot, source: Source, stop: asyncio.Event):
+    """Runs polling passes of the source, or listens to its Long Poll, until `stop` is set.
+
+    The stop is checked between passes only, so a post is never left half-sent.
+    """
+    init_ids(source.name, source.last_id)
+    temp_workspace.sweep(source.temp_folder)
+    if VK_LONG_POLL and not SINGLE_START:
+        await longpoll.listen(bot, source, stop)
+        return
+    while not stop.is_set():
+        exit_code = await main(bot, source)
+        if SINGLE_START:
+            return
+        if exit_code == 1:
+            time_to_sleep = SHORT_TIME_TO_SLEEP
+        elif ADAPTIVE_SLEEP:
+            time_to_sleep = source.scheduler.next_delay()
+        else:
+            time_to_sleep = TIME_TO_SLEEP
+        logger.info(f"[{source.name}] Script went to sleep for {time_to_sleep:.0f} seconds.")
+        await sleep_until_stopped(time_to_sleep, stop)
+
+
+async def sleep_until_stopped(delay: float, stop: asyncio.Event) -> None:
+    """Sleeps for `delay` seconds or until `stop` is set."""
+    try:
+        await asyncio.wait_for(stop.wait(), delay)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def supervise_source(bot: Bot, source: Source, stop: asyncio.Event | None = None):
+    """Runs the source and restarts it after an error, so that the other sources keep running.
+
+    The delay before a restart doubles after every failure in a row,
+    from `VAR_SHORT_TIME_TO_SLEEP` up to `VAR_TIME_TO_SLEEP`.
+    With single start a failed source is not restarted.
+
+    Args:
+        bot (Bot): Telegram bot.
+        source (Source): Source to run.
+        stop (asyncio.Event | None, optional): Event that stops the source after
+            its current pass. Defaults to None.
+    """
+    stop = stop or asyncio.Event()
+    delay = SHORT_TIME_TO_SLEEP
+    while not stop.is_set():
+        started = time.monotonic()
         try:
-            exit_code = main()
+            await run_source(bot, source, stop)
+            return
+        except Exception as ex:
             if SINGLE_START:
-                logger.info("Script has successfully completed its execution")
-                sys.exit()
-            else:
-                if exit_code == 1:
-                    logger.info(f"Script went to sleep for {SHORT_TIME_TO_SLEEP} seconds.")
-                    time.sleep(SHORT_TIME_TO_SLEEP)
-                else:
-                    logger.info(f"Script went to sleep for {TIME_TO_SLEEP} seconds.")
-                    time.sleep(TIME_TO_SLEEP)
-        except KeyboardInterrupt:
-            logger.info("Script is stopped by the user.")
-            sys.exit()
+                logger.error(f"[{source.name}] Source has stopped with an error: {ex!r}")
+                return
+            if time.monotonic() - started > TIME_TO_SLEEP:
+                delay = SHORT_TIME_TO_SLEEP
+            logger.error(f"[{source.name}] Source has stopped with an error: {ex!r}. Restart in {delay} seconds.")
+        await sleep_until_stopped(delay, stop)
+        delay = min(delay * 2, max(TIME_TO_SLEEP, SHORT_TIME_TO_SLEEP))
+
+
+async def run_worker(bot: Bot, sources: list[Source]):
+    """Runs the share of the sources leased by this worker.
+
+    Workers sharing the state database divide the sources evenly between them.
+    Leases are renewed every third of their TTL. Sources of a worker that has
+    stopped renewing them are taken over by the others once their leases expire,
+    and a worker gives sources away when new workers join. A source that is given
+    away finishes its current pass first and keeps its lease until then,
+    so the worker that takes it over never sends a post twice.
+    """
+    tasks: dict[str, asyncio.Task] = {}
+    stops: dict[str, asyncio.Event] = {}
+    logger.info(f"Worker {WORKER_ID} is started.")
+    try:
+        while True:
+            try:
+                workers_count = leases.heartbeat(WORKER_ID, LEASE_TTL)
+                quota = math.ceil(len(sources) / workers_count)
+                for name, task in list(tasks.items()):
+                    if task.done():
+                        logger.info(f"[{name}] Source has stopped, its lease is released.")
+                        del tasks[name], stops[name]
+                        leases.release(name, WORKER_ID)
+                    elif not leases.acquire(name, WORKER_ID, LEASE_TTL) and not stops[name].is_set():
+                        logger.warning(f"[{name}] Lease was lost, the source is stopped after its current pass.")
+                        stops[name].set()
+
+                running = [name for name in tasks if not stops[name].is_set()]
+                for name in running[quota:]:
+                    logger.info(f"[{name}] Source is given away to another worker after its current pass.")
+                    stops[name].set()
+
+                for source in sources:
+                    if len(running) >= quota:
+                        break
+                    if source.name not in tasks and leases.acquire(source.name, WORKER_ID, LEASE_TTL):
+                        logger.info(f"[{source.name}] Lease is acquired.")
+                        stops[source.name] = asyncio.Event()
+                        tasks[source.name] = asyncio.create_task(
+                            supervise_source(bot, source, stops[source.name])
+                        )
+                        running.append(source.name)
+            except sqlite3.OperationalError as ex:
+                logger.warning(f"Leases were not renewed: {ex}")
+
+            await asyncio.sleep(LEASE_TTL / 3)
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        leases.unregister(WORKER_ID)
+
+
+async def run():
+    sources = load_sources()
+    logger.info(f"Sources: {', '.join(source.name for source in sources)}.")
+    bot = Bot(token=TG_BOT_TOKEN)
+    install_signal_handlers()
+    metrics.collect("vktgbot_temp_folder_bytes", lambda: tools.folder_size("./temp"))
+    metrics.collect("vktgbot_temp_memory_bytes", lambda: temp_workspace.memory_used)
+    exporter = asyncio.create_task(export_metrics())
+    try:
+        if WORKER_MODE:
+            if SINGLE_START:
+                logger.critical("Worker mode can not be combined with single start.")
+                return
+            await run_worker(bot, sources)
+            return
+        await asyncio.gather(*(supervise_source(bot, source) for source in sources))
+        if SINGLE_START:
+            logger.info("Script has successfully completed its execution")
+    finally:
+        exporter.cancel()
+        await asyncio.gather(exporter, return_exceptions=True)
+        await (await bot.get_session()).close()
+        await http_session.close_session()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        logger.info("Script is stopped by the user.")
+    sys.exit()
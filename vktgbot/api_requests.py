@@ -1,30 +1,97 @@
-from typing import Union
+from typing import Iterable, Union
 
+import asyncio
 import re
-import requests
+
+import aiohttp
 from loguru import logger
 
+from cache import vk_cache
+from config import VK_API_URL, VK_EXECUTE
+import http_session
+from metrics import metrics
+from models import Post, posts_from_vk
+from vk_execute import ExecuteCoalescer
+
+
+async def call_vk(method: str, params: dict) -> dict:
+    """Calls the VK API method.
+
+    If `VK_EXECUTE` is enabled, calls issued concurrently are coalesced
+    into `execute` requests.
+
+    Args:
+        method (str): Name of the VK API method.
+        params (dict): Parameters of the request.
+
+    Returns:
+        dict: Decoded response, or an empty dict if the request failed.
+    """
+    if VK_EXECUTE:
+        data = await execute_coalescer.call(method, params)
+    else:
+        data = await request_vk(method, params)
+    metrics.inc("vktgbot_vk_calls_total", method=method, outcome=get_outcome(data))
+    return data
+
+
+def get_outcome(data: dict) -> str:
+    """Returns the outcome of the VK API call: "ok", "error" returned by VK, or "failed" request."""
+    if "response" in data:
+        return "ok"
+    if "error" in data:
+        return "error"
+    return "failed"
+
+
+async def request_vk(method: str, params: dict) -> dict:
+    """Sends a single request to the VK API method through the shared HTTP session.
+
+    Args:
+        method (str): Name of the VK API method.
+        params (dict): Parameters of the request.
+
+    Returns:
+        dict: Decoded response, or an empty dict if the request failed.
+    """
+    metrics.inc("vktgbot_vk_requests_total", method=method)
+    try:
+        if method == "execute":
+            return await http_session.post_json(f"{VK_API_URL}/{method}", data=params)
+        return await http_session.get_json(f"{VK_API_URL}/{method}", params=params)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as ex:
+        logger.error(f"Error was detected when requesting data from VK: {ex}")
+        return {}
 
-def get_data_from_vk(
+
+execute_coalescer = ExecuteCoalescer(request_vk)
+
+
+async def get_data_from_vk(
     vk_token: str,
     req_version: float,
     vk_domain: str,
     *,
     req_count: int = 100,
     req_start_post_id: int = 1
-) -> Union[dict, None]:
+) -> Union[list[Post], None]:
+    """Fetches the window of posts by their IDs.
+
+    Returns:
+        list[Post] | None: Posts of the window, empty if VK has no posts with these IDs,
+            or None if VK could not be reached or returned an error.
+    """
     logger.info("Trying to get posts from VK.")
 
-    match = re.search(r"^(club|public)(\d+)$", vk_domain)
-    if match:
-        owner_id = match.groups()[1]
-    else:
-        owner_id = get_group_id(vk_token, req_version, vk_domain)
-    owner_id = f"-{owner_id}"
+    group_id = await get_domain_group_id(vk_token, req_version, vk_domain)
+    if not group_id:
+        logger.error(f"Group ID of '{vk_domain}' could not be resolved.")
+        return None
+    owner_id = f"-{group_id}"
 
-    response = requests.get(
-        "https://api.vk.com/method/wall.getById",
-        params=dict(
+    data = await call_vk(
+        "wall.getById",
+        dict(
             {
                 "access_token": vk_token,
                 "v": req_version,
@@ -35,9 +102,8 @@ def get_data_from_vk(
             },
         ),
     )
-    data: dict = response.json()
     if "response" in data:
-        return data["response"]
+        return posts_from_vk(data["response"])
     if "error" in data:
         logger.error(
             "Error was detected when requesting data from VK: "
@@ -46,7 +112,7 @@ def get_data_from_vk(
     return None
 
 
-def get_last_id(
+async def get_last_id(
     vk_token: str,
     req_version: float,
     vk_domain: str,
@@ -60,9 +126,9 @@ def get_last_id(
     else:
         source_param = {"domain": vk_domain}
 
-    response = requests.get(
-        "https://api.vk.com/method/wall.get",
-        params=dict(
+    data = await call_vk(
+        "wall.get",
+        dict(
             {
                 "access_token": vk_token,
                 "v": req_version,
@@ -72,7 +138,6 @@ def get_last_id(
             **source_param,
         ),
     )
-    data = response.json()
     if data.get("response", {}).get("items", None):
         items = data["response"]["items"]
         if items[0].get("is_pinned", False):
@@ -86,87 +151,153 @@ def get_last_id(
     return None
 
 
-def get_video_url(
+async def get_video_urls(
     vk_token: str,
     req_version: float,
-    owner_id: str,
-    video_id: str,
-    access_key: str
-) -> str:
-    response = requests.get(
-        "https://api.vk.com/method/video.get",
-        params={
+    videos: Iterable[tuple[int, int, str]]
+) -> dict[str, str]:
+    """Resolves external links of many videos with a single request.
+
+    Args:
+        vk_token (str): VK access token.
+        req_version (float): Version of VK API.
+        videos (Iterable[tuple[int, int, str]]): Owner ID, video ID and access key of videos.
+
+    Returns:
+        dict[str, str]: External links by "{owner_id}_{video_id}" keys.
+            Videos without external link are missing.
+    """
+    urls: dict[str, str] = {}
+    requested: list[str] = []
+    for owner_id, video_id, access_key in set(videos):
+        url = vk_cache.get("video_url", f"{owner_id}_{video_id}")
+        if url:
+            urls[f"{owner_id}_{video_id}"] = url
+        else:
+            requested.append(f"{owner_id}_{video_id}{'' if not access_key else f'_{access_key}'}")
+    if not requested:
+        return urls
+
+    data = await call_vk(
+        "video.get",
+        {
             "access_token": vk_token,
             "v": req_version,
-            "videos": f"{owner_id}_{video_id}{'' if not access_key else f'_{access_key}'}",
+            "videos": ",".join(requested),
+            "count": len(requested),
         },
     )
-    data = response.json()
     if "response" in data:
-        return (
-            data["response"]
-            .get("items", [{}])[0]
-            .get("files", {})
-            .get("external", "")
-        )
+        for video in data["response"].get("items", []):
+            url = video.get("files", {}).get("external", "")
+            if url:
+                urls[f"{video['owner_id']}_{video['id']}"] = url
+                vk_cache.set("video_url", f"{video['owner_id']}_{video['id']}", url)
     if "error" in data:
         logger.error(
             "Error was detected when requesting data from VK: "
             f"{data['error']['error_msg']}"
         )
-    return ""
+    return urls
+
+
+async def get_owner_names(
+    vk_token: str,
+    req_version: float,
+    owner_ids: Iterable[int]
+) -> dict[int, str]:
+    """Resolves names of many users and groups with at most two concurrent requests.
+
+    Args:
+        vk_token (str): VK access token.
+        req_version (float): Version of VK API.
+        owner_ids (Iterable[int]): Owner IDs, negative for groups.
+
+    Returns:
+        dict[int, str]: Names by owner IDs. Unresolved owners are missing.
+    """
+    names: dict[int, str] = {}
+    group_ids: list[str] = []
+    user_ids: list[str] = []
+    for owner_id in set(owner_ids):
+        if owner_id < 0:
+            name = vk_cache.get("group_name", str(-owner_id))
+            if name:
+                names[owner_id] = name
+            else:
+                group_ids.append(str(-owner_id))
+        else:
+            name = vk_cache.get("user_name", str(owner_id))
+            if name:
+                names[owner_id] = name
+            else:
+                user_ids.append(str(owner_id))
+
+    group_names, user_names = await asyncio.gather(
+        get_group_names(vk_token, req_version, group_ids),
+        get_user_names(vk_token, req_version, user_ids),
+    )
+    names.update(group_names)
+    names.update(user_names)
+    return names
 
 
-def get_user_name(vk_token: str, req_version: float, owner_id) -> str:
-    response = requests.get(
-        "https://api.vk.com/method/users.get",
-        params={
+async def get_group_names(vk_token: str, req_version: float, group_ids: list[str]) -> dict[int, str]:
+    if not group_ids:
+        return {}
+    data = await call_vk(
+        "groups.getById",
+        {
             "access_token": vk_token,
             "v": req_version,
-            "user_ids": owner_id,
+            "group_ids": ",".join(group_ids),
         },
     )
-    data = response.json()
-    if "response" in data:
-        return f'{data["response"][0]["first_name"]} {data["response"][0]["last_name"]}'
+    names: dict[int, str] = {}
+    for group in data.get("response", []):
+        names[-group["id"]] = group["name"]
+        vk_cache.set("group_name", str(group["id"]), group["name"])
     if "error" in data:
         logger.error(
             "Error was detected when requesting data from VK: "
             f"{data['error']['error_msg']}"
         )
-    return ""
+    return names
 
 
-def get_group_name(vk_token: str, req_version: float, owner_id) -> str:
-    response = requests.get(
-        "https://api.vk.com/method/groups.getById",
-        params={
+async def get_user_names(vk_token: str, req_version: float, user_ids: list[str]) -> dict[int, str]:
+    if not user_ids:
+        return {}
+    data = await call_vk(
+        "users.get",
+        {
             "access_token": vk_token,
             "v": req_version,
-            "group_id": owner_id,
+            "user_ids": ",".join(user_ids),
         },
     )
-    data = response.json()
-    if "response" in data:
-        return data["response"][0]["name"]
+    names: dict[int, str] = {}
+    for user in data.get("response", []):
+        names[user["id"]] = f'{user["first_name"]} {user["last_name"]}'
+        vk_cache.set("user_name", str(user["id"]), names[user["id"]])
     if "error" in data:
         logger.error(
             "Error was detected when requesting data from VK: "
             f"{data['error']['error_msg']}"
         )
-    return ""
+    return names
 
 
-def get_group_id(vk_token: str, req_version: float, domain) -> int | None:
-    response = requests.get(
-        "https://api.vk.com/method/groups.getById",
-        params={
+@vk_cache.cached("group_id")
+async def get_group_id(vk_token: str, req_version: float, domain) -> int | None:
+    data = await call_vk(
+        "groups.getById",
+        {
             "access_token": vk_token,
             "v": req_version,
             "group_id": domain,
         },
     )
-    data = response.json()
     if "response" in data:
         return data["response"][0]["id"]
     if "error" in data:
@@ -175,3 +306,46 @@ def get_group_id(vk_token: str, req_version: float, domain) -> int | None:
             f"{data['error']['error_msg']}"
         )
     return None
+
+
+async def get_domain_group_id(vk_token: str, req_version: float, vk_domain: str) -> int | None:
+    match = re.search(r"^(club|public)(\d+)$", vk_domain)
+    if match:
+        return int(match.groups()[1])
+    return await get_group_id(vk_token, req_version, vk_domain)
+
+
+async def get_long_poll_server(vk_token: str, req_version: float, group_id: int) -> dict | None:
+    data = await call_vk(
+        "groups.getLongPollServer",
+        {
+            "access_token": vk_token,
+            "v": req_version,
+            "group_id": group_id,
+        },
+    )
+    if "response" in data:
+        return data["response"]
+    if "error" in data:
+        logger.error(
+            "Error was detected when requesting data from VK: "
+            f"{data['error']['error_msg']}"
+        )
+    return None
+
+
+async def check_long_poll(server: dict, wait: int) -> dict:
+    """Waits for events on the Bots Long Poll server.
+
+    Args:
+        server (dict): Server, key and ts returned by `groups.getLongPollServer`.
+        wait (int): Maximum time (in seconds) to wait for events.
+
+    Returns:
+        dict: Decoded response with `ts` and `updates`, or with `failed` code.
+    """
+    return await http_session.get_json(
+        server["server"],
+        params={"act": "a_check", "key": server["key"], "ts": server["ts"], "wait": wait},
+        timeout=wait + 10,
+    )
@@ -0,0 +1,146 @@
+import functools
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from loguru import logger
+
+from config import (
+    CACHE_FILE, CACHE_MAX_SIZE, CACHE_TTLS,
+    FILE_ID_INDEX_FILE, FILE_ID_INDEX_MAX_SIZE, FILE_ID_INDEX_TTL
+)
+from metrics import metrics
+
+
+class TTLCache:
+    """LRU cache with per-kind time-to-live that can be persisted to a JSON file.
+
+    Hits and misses are counted for every kind of entry and exposed
+    as `vktgbot_cache_lookups_total` metrics.
+
+    Args:
+        name (str): Name of the cache in the metrics.
+        path (str): Path to the file the cache is persisted to.
+        max_size (int): Maximum number of entries, the least recently used
+            entries are evicted first.
+        ttls (dict[str, int]): Time-to-live (in seconds) for every kind of entry.
+    """
+
+    def __init__(self, name: str, path: str, max_size: int, ttls: dict[str, int]):
+        self.name = name
+        self.path = path
+        self.max_size = max_size
+        self.ttls = ttls
+        self.hits: dict[str, int] = {kind: 0 for kind in ttls}
+        self.misses: dict[str, int] = {kind: 0 for kind in ttls}
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._dirty = False
+
+    def get(self, kind: str, key: str) -> Any:
+        """Returns the cached value or None if it is missing or expired."""
+        entry_key = f"{kind}:{key}"
+        entry = self._entries.get(entry_key)
+        if entry is None or entry[0] < time.time():
+            if entry is not None:
+                del self._entries[entry_key]
+                self._dirty = True
+            self.misses[kind] = self.misses.get(kind, 0) + 1
+            metrics.inc("vktgbot_cache_lookups_total", cache=self.name, kind=kind, result="miss")
+            return None
+        self._entries.move_to_end(entry_key)
+        self.hits[kind] = self.hits.get(kind, 0) + 1
+        metrics.inc("vktgbot_cache_lookups_total", cache=self.name, kind=kind, result="hit")
+        return entry[1]
+
+    def set(self, kind: str, key: str, value: Any) -> None:
+        """Stores the value for the time-to-live of its kind."""
+        entry_key = f"{kind}:{key}"
+        self._entries[entry_key] = (time.time() + self.ttls.get(kind, 0), value)
+        self._entries.move_to_end(entry_key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        self._dirty = True
+
+    def delete(self, kind: str, key: str) -> None:
+        """Removes the value if it is cached."""
+        if self._entries.pop(f"{kind}:{key}", None) is not None:
+            self._dirty = True
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Returns hit and miss counters for every kind of entry."""
+        return {
+            kind: {"hits": self.hits.get(kind, 0), "misses": self.misses.get(kind, 0)}
+            for kind in self.hits.keys() | self.misses.keys()
+        }
+
+    def load(self) -> None:
+        """Loads not expired entries from the cache file."""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                entries = json.load(file)
+            now = time.time()
+            self._entries = OrderedDict(
+                (key, (expires, value))
+                for key, (expires, value) in entries
+                if expires >= now
+            )
+        except (OSError, ValueError, TypeError) as ex:
+            logger.warning(f"Cache file '{self.path}' was not loaded: {ex}")
+            return
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def save(self) -> None:
+        """Atomically writes the entries to the cache file if they have changed."""
+        if not self._dirty:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(
+                [[key, [expires, value]] for key, (expires, value) in self._entries.items()],
+                file,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+    def cached(self, kind: str) -> Callable:
+        """Caches truthy results of a VK lookup coroutine.
+
+        The key is built from the arguments following the token and the API version.
+        """
+        def decorator(function: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+            @functools.wraps(function)
+            async def wrapper(vk_token: str, req_version: float, *args):
+                key = ":".join(str(arg) for arg in args)
+                value = self.get(kind, key)
+                if value is None:
+                    value = await function(vk_token, req_version, *args)
+                    if value:
+                        self.set(kind, key, value)
+                return value
+            return wrapper
+        return decorator
+
+
+vk_cache = TTLCache("vk", CACHE_FILE, CACHE_MAX_SIZE, CACHE_TTLS)
+vk_cache.load()
+
+# Telegram file_ids of sent VK photos and documents by "{owner_id}_{id}" keys.
+file_id_index = TTLCache(
+    "file_id",
+    FILE_ID_INDEX_FILE,
+    FILE_ID_INDEX_MAX_SIZE,
+    {"photo": FILE_ID_INDEX_TTL, "document": FILE_ID_INDEX_TTL},
+)
+file_id_index.load()
+
+
+def save_caches() -> None:
+    """Persists all caches that have changed."""
+    vk_cache.save()
+    file_id_index.save()
@@ -1,5 +1,6 @@
 import json
 import os
+import socket
 
 import dotenv
 
@@ -12,17 +13,73 @@ TG_BOT_TOKEN: str = os.getenv("VAR_TG_BOT_TOKEN", "")
 VK_TOKEN: str = os.getenv("VAR_VK_TOKEN", "")
 VK_DOMAIN: str = os.getenv("VAR_VK_DOMAIN", "")
 
+VK_API_URL: str = os.getenv("VAR_VK_API_URL", "https://api.vk.com/method")
 REQ_VERSION: float = float(os.getenv("VAR_REQ_VERSION", 5.103))
 REQ_COUNT: int = int(os.getenv("VAR_REQ_COUNT", 3))
 REQ_FILTER: str = os.getenv("VAR_REQ_FILTER", "owner")
+VK_EXECUTE: bool = os.getenv("VAR_VK_EXECUTE", "true").lower() in ("true",)
+
+VK_LONG_POLL: bool = os.getenv("VAR_VK_LONG_POLL", "").lower() in ("true",)
+VK_LONG_POLL_TOKEN: str = os.getenv("VAR_VK_LONG_POLL_TOKEN", "") or VK_TOKEN
+VK_LONG_POLL_WAIT: int = int(os.getenv("VAR_VK_LONG_POLL_WAIT", 25))
+
+HTTP_CONNECT_TIMEOUT: float = float(os.getenv("VAR_HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT: float = float(os.getenv("VAR_HTTP_READ_TIMEOUT", 60))
+HTTP_POOL_SIZE: int = int(os.getenv("VAR_HTTP_POOL_SIZE", 10))
+DOC_DOWNLOAD_CONCURRENCY: int = int(os.getenv("VAR_DOC_DOWNLOAD_CONCURRENCY", 4))
+TEMP_SPOOL_SIZE: int = int(os.getenv("VAR_TEMP_SPOOL_SIZE", 1048576))
+TEMP_MEMORY_LIMIT: int = int(os.getenv("VAR_TEMP_MEMORY_LIMIT", 67108864))
+TEMP_DISK_LIMIT: int = int(os.getenv("VAR_TEMP_DISK_LIMIT", 1073741824))
+PARSE_CONCURRENCY: int = int(os.getenv("VAR_PARSE_CONCURRENCY", 2))
+PIPELINE_DEPTH: int = int(os.getenv("VAR_PIPELINE_DEPTH", 4))
+
+TG_GLOBAL_RATE: float = float(os.getenv("VAR_TG_GLOBAL_RATE", 30))
+TG_CHAT_RATE: float = float(os.getenv("VAR_TG_CHAT_RATE", 20))
+TG_CHAT_BURST: float = float(os.getenv("VAR_TG_CHAT_BURST", 20))
+
+STATE_DB: str = os.getenv("VAR_STATE_DB", "./state.db")
+
+WORKER_MODE: bool = os.getenv("VAR_WORKER_MODE", "").lower() in ("true",)
+WORKER_ID: str = os.getenv("VAR_WORKER_ID", "") or f"{socket.gethostname()}-{os.getpid()}"
+LEASE_TTL: int = int(os.getenv("VAR_LEASE_TTL", 60))
+
+METRICS_PORT: int = int(os.getenv("VAR_METRICS_PORT", 0))
+METRICS_HOST: str = os.getenv("VAR_METRICS_HOST", "127.0.0.1")
+METRICS_FILE: str = os.getenv("VAR_METRICS_FILE", "")
+METRICS_FLUSH_INTERVAL: int = int(os.getenv("VAR_METRICS_FLUSH_INTERVAL", 15))
+
+PROFILE_CYCLES: int = int(os.getenv("VAR_PROFILE_CYCLES", 5))
+PROFILE_ON_START: bool = os.getenv("VAR_PROFILE_ON_START", "").lower() in ("true",)
+TRACE_MALLOC_ON_START: bool = os.getenv("VAR_TRACE_MALLOC_ON_START", "").lower() in ("true",)
+PROFILE_TOP: int = int(os.getenv("VAR_PROFILE_TOP", 30))
+PROFILE_FOLDER: str = os.getenv("VAR_PROFILE_FOLDER", "./logs")
+
+CACHE_FILE: str = os.getenv("VAR_CACHE_FILE", "./cache.json")
+CACHE_MAX_SIZE: int = int(os.getenv("VAR_CACHE_MAX_SIZE", 10000))
+CACHE_TTLS: dict[str, int] = {
+    "group_id": int(os.getenv("VAR_CACHE_TTL_GROUP_ID", 604800)),
+    "user_name": int(os.getenv("VAR_CACHE_TTL_NAME", 86400)),
+    "group_name": int(os.getenv("VAR_CACHE_TTL_NAME", 86400)),
+    "video_url": int(os.getenv("VAR_CACHE_TTL_VIDEO_URL", 86400)),
+}
+FILE_ID_INDEX_FILE: str = os.getenv("VAR_FILE_ID_INDEX_FILE", "./file_ids.json")
+FILE_ID_INDEX_MAX_SIZE: int = int(os.getenv("VAR_FILE_ID_INDEX_MAX_SIZE", 50000))
+FILE_ID_INDEX_TTL: int = int(os.getenv("VAR_FILE_ID_INDEX_TTL", 7776000))
 
 SINGLE_START: bool = os.getenv("VAR_SINGLE_START", "").lower() in ("true",)
 TIME_TO_SLEEP: int = int(os.getenv("VAR_TIME_TO_SLEEP", 120))
 SHORT_TIME_TO_SLEEP: int = int(os.getenv("VAR_SHORT_TIME_TO_SLEEP", 5))
+ADAPTIVE_SLEEP: bool = os.getenv("VAR_ADAPTIVE_SLEEP", "").lower() in ("true",)
+MIN_TIME_TO_SLEEP: int = int(os.getenv("VAR_MIN_TIME_TO_SLEEP", 30))
+MAX_TIME_TO_SLEEP: int = int(os.getenv("VAR_MAX_TIME_TO_SLEEP", 600))
+SLEEP_JITTER: float = float(os.getenv("VAR_SLEEP_JITTER", 0.1))
 SHOW_ORIGINAL_POST_LINK: bool = os.getenv("VAR_SHOW_ORIGINAL_POST_LINK", "").lower() in ("true",)
 SKIP_ADS_POSTS: bool = os.getenv("VAR_SKIP_ADS_POSTS", "").lower() in ("true",)
 SKIP_COPYRIGHTED_POST: bool = os.getenv("VAR_SKIP_COPYRIGHTED_POST", "").lower() in ("true")
 SKIP_REPOSTS: bool = os.getenv("VAR_SKIP_REPOSTS", "").lower() in ("true")
 
+SOURCES: list = json.loads(os.getenv("VAR_SOURCES", "[]"))
+SOURCES_FILE: str = os.getenv("VAR_SOURCES_FILE", "")
+
 WHITELIST: list = json.loads(os.getenv("VAR_WHITELIST", "[]"))
 BLACKLIST: list = json.loads(os.getenv("VAR_BLACKLIST", "[]"))
@@ -0,0 +1,107 @@
+import aiohttp
+
+from config import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_POOL_SIZE
+from models import json_loads
+
+
+_session: aiohttp.ClientSession | None = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Returns the process-wide HTTP session.
+
+    The session keeps connections alive between calls, so repeated requests
+    to the same host reuse an established TCP+TLS connection (and its cached
+    DNS lookup) instead of opening a new one every time.
+    Must be called from a running event loop.
+
+    Returns:
+        aiohttp.ClientSession: Shared session.
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit_per_host=HTTP_POOL_SIZE,
+                ttl_dns_cache=300,
+            ),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=HTTP_CONNECT_TIMEOUT,
+                sock_read=HTTP_READ_TIMEOUT,
+            ),
+            headers={"Accept-Encoding": "gzip, deflate"},
+        )
+    return _session
+
+
+async def get_json(url: str, params: dict | None = None, timeout: float | None = None) -> dict:
+    """Sends a GET request through the shared session and decodes JSON response.
+
+    Args:
+        url (str): URL to request.
+        params (dict | None, optional): Query parameters. Defaults to None.
+        timeout (float | None, optional): Read timeout (in seconds) overriding
+            the default one. Defaults to None.
+
+    Returns:
+        dict: Decoded response.
+    """
+    kwargs = {}
+    if timeout is not None:
+        kwargs["timeout"] = aiohttp.ClientTimeout(
+            sock_connect=HTTP_CONNECT_TIMEOUT,
+            sock_read=timeout,
+        )
+    async with get_session().get(url, params=params, **kwargs) as response:
+        return await response.json(content_type=None, loads=json_loads)
+
+
+async def post_json(url: str, data: dict) -> dict:
+    """Sends a form POST request through the shared session and decodes JSON response.
+
+    Args:
+        url (str): URL to request.
+        data (dict): Form fields.
+
+    Returns:
+        dict: Decoded response.
+    """
+    async with get_session().post(url, data=data) as response:
+        return await response.json(content_type=None, loads=json_loads)
+
+
+async def get_bytes(url: str) -> bytes:
+    """Downloads the whole body of the response.
+
+    Args:
+        url (str): URL to request.
+
+    Returns:
+        bytes: Body of the response.
+    """
+    async with get_session().get(url) as response:
+        response.raise_for_status()
+        return await response.read()
+
+
+async def download(url: str, path: str, chunk_size: int = 65536) -> None:
+    """Streams the body of the response to the file without buffering it in memory.
+
+    Args:
+        url (str): URL to request.
+        path (str): Path of the file to write.
+        chunk_size (int, optional): Size of chunks written to the file. Defaults to 65536.
+    """
+    async with get_session().get(url) as response:
+        response.raise_for_status()
+        with open(path, "wb") as file:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                file.write(chunk)
+
+
+async def close_session() -> None:
+    """Closes the shared session and all pooled connections."""
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
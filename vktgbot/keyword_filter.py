@@ -0,0 +1,137 @@
+import re
+from collections import deque
+from typing import Iterable
+
+
+class KeywordFilter:
+    """Matcher of many keywords compiled once, for whitelists and blacklists.
+
+    Rules are case-insensitive and can be given as:
+        - a string, which is found anywhere in the text;
+        - `{"word": "..."}`, which is found only as a whole word;
+        - `{"regex": "..."}`, a regular expression.
+
+    Words are found with the Aho-Corasick automaton, so the time of a search
+    grows with the length of the text and not with the number of words.
+    Regular expressions are compiled one by one and, when none of them has
+    groups or flags that would change meaning inside another pattern,
+    joined into one pattern as well.
+
+    Args:
+        rules (Iterable[str | dict[str, str]]): Rules of the filter.
+    """
+
+    def __init__(self, rules: Iterable[str | dict[str, str]]):
+        self.terms: list[tuple[str, bool]] = []
+        regexes: list[str] = []
+        for rule in rules:
+            if isinstance(rule, str):
+                self.terms.append((rule.lower(), False))
+            elif "word" in rule:
+                self.terms.append((rule["word"].lower(), True))
+            elif "regex" in rule:
+                regexes.append(rule["regex"])
+            else:
+                raise ValueError(f"Unknown keyword rule: {rule}")
+        self.terms = [term for term in self.terms if term[0]]
+        self.regexes = regexes
+        self.patterns: list[re.Pattern] = []
+        for regex in regexes:
+            try:
+                self.patterns.append(re.compile(regex, re.IGNORECASE))
+            except re.error as ex:
+                raise ValueError(f"Incorrect regular expression in keyword rule {{'regex': {regex!r}}}: {ex}") from ex
+        self.pattern = self._join_patterns()
+        self._build_automaton()
+
+    def _join_patterns(self) -> re.Pattern | None:
+        """Joins the regular expressions into one pattern, or returns None if they can not be joined.
+
+        Groups of a rule would be renumbered in the joined pattern and break
+        its backreferences, so only rules without groups are joined.
+        """
+        if not self.patterns or any(pattern.groups for pattern in self.patterns):
+            return None
+        try:
+            return re.compile(
+                "|".join(f"(?P<rule{index}>{regex})" for index, regex in enumerate(self.regexes)),
+                re.IGNORECASE
+            )
+        except re.error:
+            return None
+
+    def __bool__(self) -> bool:
+        return bool(self.terms or self.regexes)
+
+    def _build_automaton(self) -> None:
+        self._goto: list[dict[str, int]] = [{}]
+        self._outputs: list[list[int]] = [[]]
+        for index, (term, _) in enumerate(self.terms):
+            state = 0
+            for char in term:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._outputs.append([])
+                state = next_state
+            self._outputs[state].append(index)
+
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._outputs[next_state] += self._outputs[self._fail[next_state]]
+
+    def search(self, text: str) -> str | None:
+        """Returns the first rule found in the text, or None if there is none.
+
+        Args:
+            text (str): Text to search in.
+
+        Returns:
+            str | None: Word or regular expression of the found rule.
+        """
+        text = text.lower()
+        if self.terms:
+            goto, fail, outputs = self._goto, self._fail, self._outputs
+            state = 0
+            for position, char in enumerate(text):
+                while state and char not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(char, 0)
+                for index in outputs[state]:
+                    term, whole_word = self.terms[index]
+                    if not whole_word or is_whole_word(text, position - len(term) + 1, position + 1):
+                        return term
+        if self.pattern:
+            match = self.pattern.search(text)
+            if match:
+                return self.regexes[int(match.lastgroup[len("rule"):])]
+        elif self.patterns:
+            matches = [
+                (match.start(), index)
+                for index, pattern in enumerate(self.patterns)
+                if (match := pattern.search(text))
+            ]
+            if matches:
+                return self.regexes[min(matches)[1]]
+        return None
+
+
+def is_whole_word(text: str, start: int, end: int) -> bool:
+    return (
+        (start == 0 or not is_word_char(text[start - 1]))
+        and (end == len(text) or not is_word_char(text[end]))
+    )
+
+
+def is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
@@ -1,38 +1,180 @@
+import json
+import os
+import sqlite3
 import sys
+import time
+
 from loguru import logger
 
+from config import STATE_DB, VK_DOMAIN
+
+
+_connection: sqlite3.Connection | None = None
+
+# Time (in seconds) a statement waits for a lock held by another worker.
+# Statements run on the event loop, so a long wait would stall every source
+# of the process and the renewal of its leases.
+BUSY_TIMEOUT = 2
+
+LEGACY_FILES = {"last_id": "./last_id.txt", "last_known_id": "./last_known_id.txt"}
+
+
+def get_connection() -> sqlite3.Connection:
+    """Opens the state database on the first call.
 
-def read_id() -> int:
-    try:
-        with open("./last_id.txt", "r") as file:
-            return int(file.read())
-    except ValueError:
-        logger.critical(
-            "The value of the last identifier is incorrect. "
-            "Please check the contents of the file 'last_id.txt'."
+    The database is used in WAL mode with `synchronous=NORMAL`, so every
+    checkpoint is a cheap append to the log that survives a crash of the process.
+    Every statement is atomic, so the database can be shared by several workers,
+    while leases ensure that each source is written by one worker at a time.
+
+    Returns:
+        sqlite3.Connection: Connection to the state database.
+    """
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(STATE_DB, timeout=BUSY_TIMEOUT, isolation_level=None)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS ids ("
+            "source TEXT NOT NULL, name TEXT NOT NULL, value INTEGER NOT NULL, "
+            "PRIMARY KEY (source, name))"
+        )
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS posts ("
+            "source TEXT NOT NULL, post_id INTEGER NOT NULL, part TEXT NOT NULL, "
+            "status TEXT NOT NULL, message_ids TEXT, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (source, post_id, part))"
+        )
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            "source TEXT PRIMARY KEY, worker TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS workers ("
+            "worker TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
         )
-        sys.exit()
+    return _connection
+
+
+def read_value(source: str, name: str) -> int:
+    row = get_connection().execute(
+        "SELECT value FROM ids WHERE source = ? AND name = ?", (source, name)
+    ).fetchone()
+    return row[0] if row is not None else 0
+
 
+def write_value(source: str, name: str, new_id: int) -> None:
+    get_connection().execute(
+        "INSERT INTO ids (source, name, value) VALUES (?, ?, ?) "
+        "ON CONFLICT (source, name) DO UPDATE SET value = excluded.value",
+        (source, name, new_id),
+    )
 
-def write_id(new_id: int) -> None:
-    with open("./last_id.txt", "w") as file:
-        file.write(str(new_id))
-    logger.info(f"New ID, written in the file: {new_id}")
 
+def init_ids(source: str, initial_id: int = 0) -> None:
+    """Creates the IDs of the source if it has no state yet.
 
-def read_known_id() -> int:
-    try:
-        with open("./last_known_id.txt", "r") as file:
-            return int(file.read())
-    except ValueError:
-        logger.critical(
-            "The value of the last identifier is incorrect. "
-            "Please check the contents of the file 'last_known_id.txt'."
+    The source configured with `VAR_VK_DOMAIN` imports the IDs from the text
+    files used by previous versions, other sources start from `initial_id`.
+    The script exits if a text file has an incorrect value, as starting from
+    `initial_id` instead would send the whole wall again.
+
+    Args:
+        source (str): Name of the source.
+        initial_id (int, optional): ID of the last post that must not be sent. Defaults to 0.
+    """
+    for name, path in LEGACY_FILES.items():
+        row = get_connection().execute(
+            "SELECT value FROM ids WHERE source = ? AND name = ?", (source, name)
+        ).fetchone()
+        if row is not None:
+            continue
+        value = initial_id
+        if source == VK_DOMAIN and os.path.exists(path):
+            try:
+                with open(path, "r") as file:
+                    value = int(file.read())
+            except ValueError:
+                logger.critical(
+                    "The value of the last identifier is incorrect. "
+                    f"Please check the contents of the file '{path}'."
+                )
+                sys.exit()
+            else:
+                logger.info(f"The value {value} was imported from the file '{path}'.")
+        get_connection().execute(
+            "INSERT INTO ids (source, name, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (source, name) DO NOTHING",
+            (source, name, value),
         )
-        sys.exit()
 
 
-def write_known_id(new_id: int) -> None:
-    with open("./last_known_id.txt", "w") as file:
-        file.write(str(new_id))
-    logger.info(f"New ID, written in the file: {new_id}")
+def read_id(source: str) -> int:
+    return read_value(source, "last_id")
+
+
+def write_id(source: str, new_id: int) -> None:
+    write_value(source, "last_id", new_id)
+    logger.info(f"[{source}] New ID, written in the state: {new_id}")
+
+
+def read_known_id(source: str) -> int:
+    return read_value(source, "last_known_id")
+
+
+def write_known_id(source: str, new_id: int) -> None:
+    write_value(source, "last_known_id", new_id)
+    logger.info(f"[{source}] New known ID, written in the state: {new_id}")
+
+
+def read_post_status(source: str, post_id: int, part: str) -> str | None:
+    """Returns the delivery status of the post part, or None if it was never seen.
+
+    Args:
+        source (str): Name of the source of the post.
+        post_id (int): ID of the VK post.
+        part (str): Part of the post: "post" or "repost",
+            or its delivery to a channel: "{part}@{tg_channel}".
+    """
+    row = get_connection().execute(
+        "SELECT status FROM posts WHERE source = ? AND post_id = ? AND part = ?",
+        (source, post_id, part),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def write_post_status(
+    source: str,
+    post_id: int,
+    part: str,
+    status: str,
+    message_ids: list[int] | None = None
+) -> None:
+    """Records the delivery status of the post part in the journal.
+
+    Args:
+        source (str): Name of the source of the post.
+        post_id (int): ID of the VK post.
+        part (str): Part of the post: "post" or "repost",
+            or its delivery to a channel: "{part}@{tg_channel}".
+        status (str): "fetched", "parsed", "sent", "skipped" or "failed".
+        message_ids (list[int] | None, optional): IDs of the sent Telegram messages.
+            Defaults to None.
+    """
+    get_connection().execute(
+        "INSERT INTO posts (source, post_id, part, status, message_ids, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (source, post_id, part) DO UPDATE SET "
+        "status = excluded.status, "
+        "message_ids = COALESCE(excluded.message_ids, posts.message_ids), "
+        "updated_at = excluded.updated_at",
+        (
+            source,
+            post_id,
+            part,
+            status,
+            json.dumps(message_ids) if message_ids is not None else None,
+            time.time(),
+        ),
+    )
@@ -0,0 +1,64 @@
+import time
+
+from last_id import get_connection
+
+
+def heartbeat(worker: str, ttl: int) -> int:
+    """Marks the worker as alive for `ttl` seconds and counts the live workers.
+
+    Args:
+        worker (str): ID of the worker.
+        ttl (int): Time (in seconds) the worker is considered alive without a heartbeat.
+
+    Returns:
+        int: Number of live workers, including this one.
+    """
+    now = time.time()
+    connection = get_connection()
+    connection.execute(
+        "INSERT INTO workers (worker, expires_at) VALUES (?, ?) "
+        "ON CONFLICT (worker) DO UPDATE SET expires_at = excluded.expires_at",
+        (worker, now + ttl),
+    )
+    connection.execute("DELETE FROM workers WHERE expires_at < ?", (now,))
+    return connection.execute("SELECT COUNT(*) FROM workers").fetchone()[0]
+
+
+def unregister(worker: str) -> None:
+    """Removes the worker and releases all its leases."""
+    connection = get_connection()
+    connection.execute("DELETE FROM leases WHERE worker = ?", (worker,))
+    connection.execute("DELETE FROM workers WHERE worker = ?", (worker,))
+
+
+def acquire(source: str, worker: str, ttl: int) -> bool:
+    """Takes or renews the lease of the source for `ttl` seconds.
+
+    The lease is granted if the source is free, if its lease has expired
+    or if it is already held by the worker. The check and the update are
+    done by one statement, so two workers can never hold the same source.
+
+    Args:
+        source (str): Name of the source.
+        worker (str): ID of the worker.
+        ttl (int): Duration of the lease in seconds.
+
+    Returns:
+        bool: True if the worker holds the lease, False otherwise.
+    """
+    now = time.time()
+    cursor = get_connection().execute(
+        "INSERT INTO leases (source, worker, expires_at) VALUES (?, ?, ?) "
+        "ON CONFLICT (source) DO UPDATE SET "
+        "worker = excluded.worker, expires_at = excluded.expires_at "
+        "WHERE leases.worker = excluded.worker OR leases.expires_at < ?",
+        (source, worker, now + ttl, now),
+    )
+    return cursor.rowcount > 0
+
+
+def release(source: str, worker: str) -> None:
+    """Releases the lease of the source if it is held by the worker."""
+    get_connection().execute(
+        "DELETE FROM leases WHERE source = ? AND worker = ?", (source, worker)
+    )
@@ -0,0 +1,129 @@
+import asyncio
+
+import aiohttp
+from aiogram import Bot
+from loguru import logger
+
+import api_requests
+from cache import save_caches
+import config
+from last_id import read_id, write_id, read_known_id, write_known_id
+from metrics import metrics
+from profiling import profiler
+from models import Post
+from sources import Source
+from start_script import start_script, send_new_posts, update_backlog
+from workspace import temp_workspace
+
+
+POST_TYPES = ("post", "copy")
+
+
+async def catch_up(bot: Bot, source: Source, stop: asyncio.Event | None = None) -> None:
+    """Runs polling passes until every post up to the last one on the wall is handled
+    or `stop` is set.
+
+    Used on (re)connection to the Long Poll server and when an event
+    reveals that some posts were missed. Passes that fetch nothing because
+    VK fails are repeated with a growing delay, up to `VAR_TIME_TO_SLEEP`.
+    """
+    delay = config.SHORT_TIME_TO_SLEEP
+    while True:
+        last_known_id = read_known_id(source.name)
+        with profiler.cycle(), metrics.time("vktgbot_cycle_seconds", source=source.name):
+            exit_code = await start_script(bot, source)
+        update_backlog(source)
+        temp_workspace.sweep(source.temp_folder)
+        save_caches()
+        if read_known_id(source.name) >= read_id(source.name) or (stop and stop.is_set()):
+            return
+        if exit_code == 1 or read_known_id(source.name) > last_known_id:
+            delay = config.SHORT_TIME_TO_SLEEP
+            continue
+        logger.info(f"[{source.name}] Posts were not fetched. Retry in {delay} seconds.")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max(config.TIME_TO_SLEEP, config.SHORT_TIME_TO_SLEEP))
+
+
+async def handle_new_post(bot: Bot, source: Source, post: Post) -> None:
+    """Sends the post received from the `wall_post_new` event.
+
+    Args:
+        bot (Bot): Telegram bot.
+        source (Source): Source the event was received for.
+        post (Post): Post of the event.
+    """
+    if post.post_type not in POST_TYPES:
+        return
+    last_known_id = read_known_id(source.name)
+    if post.id <= last_known_id:
+        return
+    if post.id > read_id(source.name):
+        write_id(source.name, post.id)
+    if post.id > last_known_id + 1:
+        logger.info(f"Posts before ID {post.id} may be missed. Catching up.")
+        await catch_up(bot, source)
+        return
+
+    logger.info(f"[{source.name}] Got a new post with ID {post.id} from Long Poll.")
+    await send_new_posts(bot, source, [post], last_known_id)
+    write_known_id(source.name, post.id)
+    update_backlog(source)
+    temp_workspace.sweep(source.temp_folder)
+    save_caches()
+
+
+@logger.catch(reraise=True)
+async def listen(bot: Bot, source: Source, stop: asyncio.Event | None = None) -> None:
+    """Receives new posts through the VK Bots Long Poll API and sends them to Telegram.
+
+    Posts published while the connection was down are fetched
+    with polling passes after every (re)connection.
+
+    Args:
+        bot (Bot): Telegram bot.
+        source (Source): Source to listen to.
+        stop (asyncio.Event | None, optional): Event that stops listening once
+            the received posts are sent. Defaults to None.
+    """
+    stop = stop or asyncio.Event()
+    group_id = await api_requests.get_domain_group_id(
+        source.long_poll_token,
+        config.REQ_VERSION,
+        source.vk_domain
+    )
+    if not group_id:
+        logger.critical(f"[{source.name}] Group ID of the VK community could not be resolved for Long Poll.")
+        return
+
+    while not stop.is_set():
+        server = await api_requests.get_long_poll_server(
+            source.long_poll_token,
+            config.REQ_VERSION,
+            group_id
+        )
+        if not server:
+            logger.info(f"[{source.name}] Long Poll is unavailable. Retry in {config.SHORT_TIME_TO_SLEEP} seconds.")
+            await asyncio.sleep(config.SHORT_TIME_TO_SLEEP)
+            continue
+        logger.info(f"[{source.name}] Connected to VK Long Poll server.")
+        await catch_up(bot, source, stop)
+
+        while not stop.is_set():
+            try:
+                data = await api_requests.check_long_poll(server, config.VK_LONG_POLL_WAIT)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as ex:
+                logger.warning(f"[{source.name}] Long Poll connection was lost: {ex}")
+                break
+
+            if "failed" in data:
+                if data["failed"] == 1:
+                    server["ts"] = data["ts"]
+                    continue
+                logger.info(f"[{source.name}] Long Poll key has expired.")
+                break
+
+            server["ts"] = data["ts"]
+            for update in data.get("updates", []):
+                if update["type"] == "wall_post_new":
+                    await handle_new_post(bot, source, Post.from_vk(update["object"]))
@@ -0,0 +1,207 @@
+import re
+from dataclasses import dataclass, field
+
+
+MESSAGE_LIMIT = 4096
+CAPTION_LIMIT = 1024
+MEDIA_GROUP_LIMIT = 10
+MAX_WORD_SIZE = 64
+
+CONTINUATION_START = "(...) "
+CONTINUATION_END = " (...)"
+
+TOKEN_PATTERN = re.compile(
+    r"<(/?)(\w+)[^>]*>"   # tag
+    r"|&#?\w+;"           # entity
+    r"|\n\n+|\n|[^\S\n]+" # whitespace
+    r"|[^\s<&]+|[<&]"     # word
+)
+HTML_TAG_PATTERN = re.compile(r"<[^>]*>")
+HTML_ENTITY_PATTERN = re.compile(r"&#?\w+;")
+SENTENCE_ENDS = (".", "!", "?", "…")
+
+# Ranks of places to split the text at, the higher the better.
+WORD_BREAK = 1
+SENTENCE_BREAK = 2
+LINE_BREAK = 3
+PARAGRAPH_BREAK = 4
+
+
+@dataclass
+class PlannedMessage:
+    """Telegram call of the post.
+
+    `method` is "message", "photo", "document" or "media_group".
+    `media` holds parsed photos or documents of `media_type`,
+    `text` is the text of the message or the caption of the media.
+    """
+
+    method: str
+    text: str = ""
+    media: list[dict] = field(default_factory=list)
+    media_type: str = ""
+
+
+def visible_length(text: str) -> int:
+    """Returns the length of the HTML text as Telegram counts it: in UTF-16 units without tags."""
+    text = HTML_ENTITY_PATTERN.sub("&", HTML_TAG_PATTERN.sub("", text))
+    return len(text.encode("utf-16-le")) // 2
+
+
+def tokenize(text: str) -> list[tuple[str, int, int, tuple[str, str] | None]]:
+    """Splits the HTML text into atoms the text can be split between.
+
+    Returns:
+        list[tuple[str, int, int, tuple[str, str] | None]]: Markup of the atom,
+            its visible length, rank of the break after it and, for tags,
+            whether it is opening or closing ("" or "/") with the name of the tag.
+    """
+    atoms = []
+    previous = ""
+    for match in TOKEN_PATTERN.finditer(text):
+        markup = match[0]
+        if match[2]:
+            atoms.append((markup, 0, 0, (match[1], match[2].lower())))
+        elif markup[0] == "&" and len(markup) > 1:
+            atoms.append((markup, 1, 0, None))
+            previous = markup
+        elif markup.isspace():
+            if "\n\n" in markup:
+                rank = PARAGRAPH_BREAK
+            elif "\n" in markup:
+                rank = LINE_BREAK
+            elif previous.endswith(SENTENCE_ENDS):
+                rank = SENTENCE_BREAK
+            else:
+                rank = WORD_BREAK
+            atoms.append((markup, len(markup), rank, None))
+            previous = markup
+        else:
+            for start in range(0, len(markup), MAX_WORD_SIZE):
+                word = markup[start:start + MAX_WORD_SIZE]
+                atoms.append((word, len(word.encode("utf-16-le")) // 2, 0, None))
+            previous = markup
+    return atoms
+
+
+def split_html(text: str, limit: int = MESSAGE_LIMIT) -> list[str]:
+    """Splits the HTML text into as few parts of at most `limit` visible characters as possible.
+
+    The text is split at the end of a paragraph, line, sentence or word, whichever
+    is the best in the last quarter of the part. Tags open at the split are closed
+    at the end of the part and opened again at the start of the next one.
+    Parts are marked as continued with "(...)".
+
+    Args:
+        text (str): HTML text.
+        limit (int, optional): Maximum visible length of a part. Defaults to 4096.
+
+    Returns:
+        list[str]: Parts of the text.
+    """
+    if visible_length(text) <= limit:
+        return [text] if text else []
+    # Whitespace around the text is dropped anyway, it must not cause a split.
+    text = text.strip()
+    if visible_length(text) <= limit:
+        return [text] if text else []
+
+    atoms = tokenize(text)
+    budget = limit - len(CONTINUATION_START) - len(CONTINUATION_END)
+    parts = []
+    start = 0
+    start_stack: tuple[tuple[str, str], ...] = ()
+    while start < len(atoms):
+        stack = list(start_stack)
+        length = 0
+        candidates = []
+        index = start
+        while index < len(atoms):
+            markup, size, rank, tag = atoms[index]
+            if length + size > budget:
+                break
+            length += size
+            index += 1
+            if tag:
+                update_stack(stack, tag, markup)
+            if rank:
+                candidates.append((index, rank, tuple(stack), length))
+
+        end, end_stack = index, tuple(stack)
+        if index < len(atoms) and candidates:
+            last_quarter = [candidate for candidate in candidates if candidate[3] >= budget * 3 // 4]
+            end, _, end_stack, _ = max(
+                last_quarter or candidates, key=lambda candidate: (candidate[1], candidate[0])
+            )
+
+        body = "".join(atom[0] for atom in atoms[start:end]).strip()
+        parts.append(
+            "".join(opening for _, opening in start_stack)
+            + body
+            + "".join(f"</{name}>" for name, _ in reversed(end_stack))
+        )
+        start, start_stack = end, end_stack
+        while start < len(atoms) and atoms[start][2]:
+            start += 1
+
+    if len(parts) == 1:
+        return parts
+    return (
+        [parts[0] + CONTINUATION_END]
+        + [CONTINUATION_START + part + CONTINUATION_END for part in parts[1:-1]]
+        + [CONTINUATION_START + parts[-1]]
+    )
+
+
+def update_stack(stack: list[tuple[str, str]], tag: tuple[str, str], markup: str) -> None:
+    closing, name = tag
+    if not closing:
+        stack.append((name, markup))
+        return
+    for position in range(len(stack) - 1, -1, -1):
+        if stack[position][0] == name:
+            del stack[position:]
+            return
+
+
+def plan_messages(
+    text: str,
+    photos: list[dict],
+    docs: list[dict],
+) -> list[PlannedMessage]:
+    """Plans the fewest Telegram calls that send the post.
+
+    The text fills messages up to their limit and its last part becomes
+    the caption of the media if it fits. Photos and documents are sent
+    in groups of up to 10 items, a single item is sent on its own.
+    A single photo with a long text is shown as the preview of the text message.
+
+    Args:
+        text (str): HTML text of the post.
+        photos (list[dict]): Parsed photos.
+        docs (list[dict]): Parsed documents that can be uploaded or sent by file_id.
+
+    Returns:
+        list[PlannedMessage]: Calls in the order they must be made.
+    """
+    if not photos and not docs:
+        return [PlannedMessage("message", part) for part in split_html(text)]
+
+    if len(photos) == 1 and not docs and visible_length(text) > CAPTION_LIMIT:
+        prepared_text = f'<a href="{photos[0]["url"]}"> </a>{text}'
+        if visible_length(prepared_text) <= MESSAGE_LIMIT:
+            return [PlannedMessage("message", prepared_text)]
+
+    parts = split_html(text)
+    caption = ""
+    if parts and visible_length(parts[-1]) <= CAPTION_LIMIT:
+        caption = parts.pop()
+    plan = [PlannedMessage("message", part) for part in parts]
+
+    for media_type, media in (("photo", photos), ("document", docs)):
+        for start in range(0, len(media), MEDIA_GROUP_LIMIT):
+            group = media[start:start + MEDIA_GROUP_LIMIT]
+            method = media_type if len(group) == 1 else "media_group"
+            plan.append(PlannedMessage(method, caption, group, media_type))
+            caption = ""
+    return plan
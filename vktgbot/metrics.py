@@ -0,0 +1,179 @@
+import asyncio
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from aiohttp import web
+from loguru import logger
+
+from config import METRICS_PORT, METRICS_HOST, METRICS_FILE, METRICS_FLUSH_INTERVAL
+
+
+# Upper bounds (in seconds) of histogram buckets, from fast calls to the publish lag of old posts.
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600, 86400)
+
+# Types and descriptions of the exposed metrics.
+METRICS: dict[str, tuple[str, str]] = {
+    "vktgbot_cycle_seconds": ("histogram", "Duration of a polling pass of the source."),
+    "vktgbot_stage_seconds": ("histogram", "Time spent in a stage of handling posts."),
+    "vktgbot_vk_calls_total": ("counter", "VK API method calls by outcome."),
+    "vktgbot_vk_requests_total": ("counter", "HTTP requests to VK API, an execute batch is one request."),
+    "vktgbot_telegram_calls_total": ("counter", "Telegram Bot API calls by outcome."),
+    "vktgbot_retry_after_seconds_total": ("counter", "Seconds of flood limits imposed by Telegram."),
+    "vktgbot_publish_lag_seconds": ("histogram", "Time from publishing of a post in VK to its delivery to Telegram."),
+    "vktgbot_backlog_posts": ("gauge", "Post IDs between the last handled post and the last post on the wall."),
+    "vktgbot_cache_lookups_total": ("counter", "Lookups in the caches of VK data and Telegram file_ids by result."),
+    "vktgbot_temp_folder_bytes": ("gauge", "Size of the temp folder."),
+    "vktgbot_temp_memory_bytes": ("gauge", "Size of the downloaded files kept in memory."),
+}
+
+
+class Metrics:
+    """Registry of the metrics of the process, rendered in the Prometheus text format.
+
+    Recording does nothing if the registry is disabled.
+
+    Args:
+        enabled (bool): Whether the metrics are recorded.
+    """
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._values: dict[str, dict[tuple, float]] = defaultdict(dict)
+        # Counts of every bucket, followed by the sum and the count of observations.
+        self._histograms: dict[str, dict[tuple, list[float]]] = defaultdict(dict)
+        self._collectors: dict[str, Callable[[], float]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        """Increases the counter."""
+        if not self.enabled:
+            return
+        values = self._values[name]
+        key = tuple(sorted(labels.items()))
+        values[key] = values.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        """Sets the value of the gauge."""
+        if self.enabled:
+            self._values[name][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Adds the observation to the histogram."""
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        histogram = self._histograms[name].get(key)
+        if histogram is None:
+            histogram = self._histograms[name][key] = [0] * (len(BUCKETS) + 2)
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[index] += 1
+                break
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    @contextmanager
+    def time(self, name: str, **labels: str) -> Iterator[None]:
+        """Adds the duration of the block to the histogram."""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def collect(self, name: str, function: Callable[[], float]) -> None:
+        """Makes the gauge take the value of the function every time the metrics are rendered."""
+        self._collectors[name] = function
+
+    def render(self) -> str:
+        """Returns the metrics in the Prometheus text format."""
+        for name, function in self._collectors.items():
+            self.set(name, function())
+
+        lines = []
+        for name, (metric_type, description) in METRICS.items():
+            values = self._values.get(name)
+            histograms = self._histograms.get(name)
+            if not values and not histograms:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for key, value in (values or {}).items():
+                lines.append(f"{name}{format_labels(key)} {value:g}")
+            for key, histogram in (histograms or {}).items():
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(key + (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{name}_bucket{format_labels(key + (('le', '+Inf'),))} {histogram[-1]}")
+                lines.append(f"{name}_sum{format_labels(key)} {histogram[-2]:g}")
+                lines.append(f"{name}_count{format_labels(key)} {histogram[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(str(value))}"' for name, value in labels) + "}"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics(enabled=bool(METRICS_PORT or METRICS_FILE))
+
+
+async def export() -> None:
+    """Exposes the metrics until cancelled.
+
+    The metrics are served at `/metrics` on `VAR_METRICS_PORT` and/or written
+    to `VAR_METRICS_FILE` every `VAR_METRICS_FLUSH_INTERVAL` seconds.
+    Does nothing if neither is set.
+    """
+    if not metrics.enabled:
+        return
+    runner = None
+    if METRICS_PORT:
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+        except OSError as ex:
+            logger.error(f"Metrics could not be served on port {METRICS_PORT}: {ex}")
+            await runner.cleanup()
+            runner = None
+        else:
+            logger.info(f"Metrics are served at http://{METRICS_HOST}:{METRICS_PORT}/metrics.")
+    try:
+        while True:
+            if METRICS_FILE:
+                write_metrics(METRICS_FILE)
+            await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+    finally:
+        if METRICS_FILE:
+            write_metrics(METRICS_FILE)
+        if runner is not None:
+            await runner.cleanup()
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+
+def write_metrics(path: str) -> None:
+    """Replaces the file with the current metrics, so readers never see a partial file."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(metrics.render())
+        os.replace(tmp_path, path)
+    except OSError as ex:
+        logger.warning(f"Metrics could not be written to '{path}': {ex}")
@@ -1,122 +1,182 @@
+import asyncio
 import re
-from typing import Iterable, Union
+from typing import Any, Callable, Iterable, Union
 
-import requests
+import aiohttp
 from loguru import logger
 
 import api_requests
-from config import REQ_VERSION, VK_TOKEN, SHOW_ORIGINAL_POST_LINK
+from cache import file_id_index
+from config import REQ_VERSION, VK_TOKEN, DOC_DOWNLOAD_CONCURRENCY
+from metrics import metrics
+from models import Attachment, Doc, Link, Photo, Post, Video
+from send_posts import MAX_DOC_SIZE
 import tools
+from workspace import StoredFile, TempScope
 
 
-def parse_post(
-    post: dict,
+doc_download_semaphore = asyncio.Semaphore(DOC_DOWNLOAD_CONCURRENCY)
+
+PHOTO_URL_PARAMS_PATTERN = re.compile("&([a-zA-Z]+(_[a-zA-Z]+)+)=([a-zA-Z0-9-_]+)")
+
+
+async def resolve_window(items: Iterable[Post], skip_reposts: bool) -> dict[str, dict]:
+    """Resolves authors of reposts and links to videos of all posts in the window at once.
+
+    Args:
+        items (Iterable[Post]): Posts that are going to be sent.
+        skip_reposts (bool): Whether the reposted posts are dropped.
+
+    Returns:
+        dict[str, dict]: Names of repost authors by owner IDs ("names")
+            and external links to videos by "{owner_id}_{video_id}" keys ("videos").
+    """
+    owner_ids: list[int] = []
+    videos: list[tuple[int, int, str]] = []
+    for item in items:
+        parts = [item]
+        if item.copy_history and not skip_reposts:
+            parts.append(item.copy_history[0])
+            owner_ids.append(item.copy_history[0].owner_id)
+        for part in parts:
+            for attachment in part.attachments:
+                if isinstance(attachment, Video):
+                    videos.append((attachment.owner_id, attachment.id, attachment.access_key))
+
+    names, video_urls = await asyncio.gather(
+        api_requests.get_owner_names(VK_TOKEN, REQ_VERSION, owner_ids),
+        api_requests.get_video_urls(VK_TOKEN, REQ_VERSION, videos),
+    )
+    return {"names": names, "videos": video_urls}
+
+
+async def parse_post(
+    post: Post,
     repost_exists: bool,
     post_type: str,
-    group_name: str
+    group_name: str,
+    video_urls: dict[str, str],
+    show_original_post_link: bool = False,
+    scope: TempScope | None = None
 ) -> dict[str, str|list[str|dict[str, str]]|bool]:
-    text = tools.prepare_text_for_html(post["text"])
+    text, known_urls = tools.render_vk_text(post.text)
     if repost_exists:
         text = tools.prepare_text_for_reposts(text, post, post_type, group_name)
-    elif SHOW_ORIGINAL_POST_LINK:
-        post_link = f'https://vk.com/wall{post["owner_id"]}_{post["id"]}'
+    elif show_original_post_link:
+        post_link = f"https://vk.com/wall{post.owner_id}_{post.id}"
         text = f'<a href="{post_link}"><b>Original post</b></a>\n\n{text}'
 
-    text = tools.reformat_vk_links(text)
-
     urls: list[str] = []
     videos: list[str] = []
-    photos: list[str] = []
-    docs: list[dict[str, str]] = []
+    photos: list[dict[str, str]] = []
+    docs: list[dict[str, str|int|StoredFile|None]] = []
 
-    if "attachments" in post:
-        parse_attachments(post["attachments"], text, urls, videos, photos, docs)
+    if post.attachments:
+        await parse_attachments(
+            post.attachments, known_urls, video_urls, urls, videos, photos, docs, scope
+        )
 
     avatar_update = False
-    if photos and post.get("post_source", {}).get("data", "")=="profile_photo":
+    if photos and post.post_source_data == "profile_photo":
         avatar_update = True
 
-    text = tools.add_urls_to_text(text, urls, videos)
+    text = tools.add_urls_to_text(text, urls, videos, known_urls)
     logger.info(f"{post_type.capitalize()} parsing is complete.")
     return {"text": text, "photos": photos, "docs": docs, "avatar_update": avatar_update}
 
 
-def parse_attachments(
-    attachments: Iterable[dict[str]],
-    text: str,
+async def parse_attachments(
+    attachments: Iterable[Attachment],
+    known_urls: set[str],
+    video_urls: dict[str, str],
     urls: list[str],
     videos: list[str],
-    photos: list[str],
-    docs: list[dict[str, str]]
+    photos: list[dict[str, str]],
+    docs: list[dict[str, str|int|StoredFile|None]],
+    scope: TempScope | None = None
 ):
+    doc_tasks = []
+    results = {Link: urls, Video: videos, Photo: photos, Doc: doc_tasks}
     for attachment in attachments:
-        if attachment["type"] == "link":
-            url = get_url(attachment, text)
-            if url:
-                urls.append(url)
-        elif attachment["type"] == "video":
-            video = get_video(attachment)
-            if video:
-                videos.append(video)
-        elif attachment["type"] == "photo":
-            photo = get_photo(attachment)
-            if photo:
-                photos.append(photo)
-        elif attachment["type"] == "doc":
-            doc = get_doc(attachment["doc"])
-            if doc:
-                docs.append(doc)
-
-
-def get_url(attachment: dict[str, dict[str, str]], text: str) -> Union[str, None]:
-    url = attachment.get("link", {}).get("url", "")
-    return url if url not in text else None
-
-
-def get_video(attachment: dict[str, dict[str, str]]) -> str:
-    owner_id = attachment["video"]["owner_id"]
-    video_id = attachment["video"]["id"]
-    video_type = attachment["video"]["type"]
-    access_key = attachment["video"].get("access_key", "")
-
-    video = api_requests.get_video_url(VK_TOKEN, REQ_VERSION, owner_id, video_id, access_key)
-    if video:
-        return video
-    if video_type == "short_video":
-        return f"https://vk.com/clip{owner_id}_{video_id}"
-    return f"https://vk.com/video{owner_id}_{video_id}"
-
-
-def get_photo(attachment: dict[str, dict[str, list[dict[str, str]]]]) -> Union[str, None]:
-    sizes = attachment["photo"]["sizes"]
-    types = ["w", "z", "y", "x", "r", "q", "p", "o", "m", "s"]
-
-    for type_ in types:
-        if next(
-            (item for item in sizes if item["type"] == type_),
-            False,
-        ):
-            return re.sub(
-                "&([a-zA-Z]+(_[a-zA-Z]+)+)=([a-zA-Z0-9-_]+)",
-                "",
-                next(
-                    (item for item in sizes if item["type"] == type_)
-                )["url"],
-            )
-    return None
-
-
-def get_doc(doc: dict[str, str|int]) -> Union[dict[str, str], None]:
-    if doc["size"] > 50000000:
+        handler = ATTACHMENT_HANDLERS.get(type(attachment))
+        if handler is None:
+            continue
+        result = handler(attachment, known_urls, video_urls, scope)
+        if result:
+            results[type(attachment)].append(result)
+
+    docs.extend(doc for doc in await asyncio.gather(*doc_tasks) if doc)
+
+
+def get_url(link: Link, known_urls: set[str]) -> Union[str, None]:
+    return link.url if link.url not in known_urls else None
+
+
+def get_video(video: Video, video_urls: dict[str, str]) -> str:
+    url = video_urls.get(f"{video.owner_id}_{video.id}")
+    if url:
+        return url
+    if video.type == "short_video":
+        return f"https://vk.com/clip{video.owner_id}_{video.id}"
+    return f"https://vk.com/video{video.owner_id}_{video.id}"
+
+
+def get_photo(photo: Photo) -> dict[str, str]:
+    return {"url": PHOTO_URL_PARAMS_PATTERN.sub("", photo.url), "key": photo.key}
+
+
+async def get_doc(
+    doc: Doc,
+    scope: TempScope | None = None
+) -> Union[dict[str, str|int|StoredFile|None], None]:
+    """Downloads the document to the temp scope of the post.
+
+    Documents too large to be uploaded to Telegram are not downloaded
+    and are returned without a file, to be sent as links. Documents
+    that have already been uploaded to Telegram are not downloaded either,
+    nor are any documents if there is no scope.
+
+    Args:
+        doc (Doc): Document attachment of the post.
+        scope (TempScope | None, optional): Temp scope of the post part. Defaults to None.
+
+    Returns:
+        Union[dict[str, str|int|StoredFile|None], None]: Title, URL, size, downloaded file
+            and key of the document, or None if the document is skipped.
+    """
+    if doc.size > 50000000:
         logger.info(
             "The document was skipped due to its size exceeding the 50MB limit: "
-            f"{doc['size']=}."
+            f"{doc.size=}."
         )
         return None
 
-    response = requests.get(doc["url"])
-
-    with open(f'./temp/{tools.slug_filename(doc["title"])}', "wb") as file:
-        file.write(response.content)
-
-    return {"title": doc["title"], "url": doc["url"]}
+    parsed_doc = {
+        "title": doc.title,
+        "url": doc.url,
+        "size": doc.size,
+        "file": None,
+        "key": doc.key,
+    }
+    if scope is None or doc.size > MAX_DOC_SIZE or file_id_index.get("document", parsed_doc["key"]):
+        return parsed_doc
+
+    async with doc_download_semaphore:
+        try:
+            with metrics.time("vktgbot_stage_seconds", stage="doc_download"):
+                parsed_doc["file"] = await scope.download(
+                    doc.url, tools.slug_filename(doc.title), doc.size
+                )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+            logger.error(f"The document could not be downloaded: {ex}")
+    return parsed_doc
+
+
+# Parsers of the attachment models, called with the attachment, known URLs,
+# URLs of videos and the temp scope. The document parser returns a coroutine.
+ATTACHMENT_HANDLERS: dict[type, Callable[[Any, set[str], dict[str, str], TempScope | None], Any]] = {
+    Link: lambda link, known_urls, video_urls, scope: get_url(link, known_urls),
+    Video: lambda video, known_urls, video_urls, scope: get_video(video, video_urls),
+    Photo: lambda photo, known_urls, video_urls, scope: get_photo(photo),
+    Doc: lambda doc, known_urls, video_urls, scope: get_doc(doc, scope),
+}
@@ -0,0 +1,160 @@
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import signal
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterator
+
+from loguru import logger
+
+from config import PROFILE_CYCLES, PROFILE_ON_START, TRACE_MALLOC_ON_START, PROFILE_TOP, PROFILE_FOLDER
+
+
+class Profiler:
+    """Captures CPU profiles and allocation traces of polling passes on demand.
+
+    A requested CPU profile covers the next `cycles` passes of all sources,
+    a requested allocation trace covers the next pass. Reports with the
+    slowest functions and the top allocation sites are written to `folder`.
+    While nothing is requested, wrapping a pass costs a single check.
+
+    Args:
+        cycles (int): Number of passes a CPU profile covers.
+        top (int): Number of functions and allocation sites in the reports.
+        folder (str): Folder the reports are written to.
+    """
+
+    def __init__(self, cycles: int, top: int, folder: str):
+        self.cycles = cycles
+        self.top = top
+        self.folder = folder
+        self._cycles_left = 0
+        self._active_cycles = 0
+        self._profile: cProfile.Profile | None = None
+        self._trace_requested = False
+        self._tracing = False
+
+    def request_profile(self) -> None:
+        """Makes the next passes be profiled."""
+        logger.info(f"CPU profile of the next {self.cycles} passes is requested.")
+        self._cycles_left = self.cycles
+
+    def request_trace(self) -> None:
+        """Makes the allocations of the next pass be traced."""
+        logger.info("Allocation trace of the next pass is requested.")
+        self._trace_requested = True
+
+    @contextmanager
+    def cycle(self) -> Iterator[None]:
+        """Profiles and traces the polling pass run in the block if it is requested."""
+        if not (self._cycles_left or self._profile or self._trace_requested):
+            yield
+            return
+
+        profiled = self._start_profile()
+        traced = self._start_trace()
+        try:
+            yield
+        finally:
+            if traced:
+                self._stop_trace(*traced)
+            if profiled:
+                self._stop_profile()
+
+    def _start_profile(self) -> bool:
+        if not self._cycles_left:
+            return False
+        self._cycles_left -= 1
+        self._active_cycles += 1
+        if self._profile is None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        return True
+
+    def _stop_profile(self) -> None:
+        # Passes of several sources overlap, so the profile is stopped after the last one.
+        self._active_cycles -= 1
+        if self._cycles_left or self._active_cycles:
+            return
+        self._profile.disable()
+        profile, self._profile = self._profile, None
+        path = self._report_path("profile")
+        report = io.StringIO()
+        for sort_key, title in (("cumulative", "cumulative time"), ("tottime", "own time")):
+            report.write(f"Top {self.top} functions by {title}:\n")
+            pstats.Stats(profile, stream=report).sort_stats(sort_key).print_stats(self.top)
+        if self._write_report(f"{path}.txt", report.getvalue()):
+            profile.dump_stats(f"{path}.prof")
+
+    def _start_trace(self) -> tuple[tracemalloc.Snapshot, bool] | None:
+        if not self._trace_requested or self._tracing:
+            return None
+        self._trace_requested = False
+        self._tracing = True
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        return tracemalloc.take_snapshot(), started_here
+
+    def _stop_trace(self, before: tracemalloc.Snapshot, started_here: bool) -> None:
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if started_here:
+            tracemalloc.stop()
+        self._tracing = False
+
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ]
+        before, after = before.filter_traces(filters), after.filter_traces(filters)
+        lines = [
+            f"Traced memory after the pass: {current / 2**20:.1f} MB, peak: {peak / 2**20:.1f} MB.",
+            "",
+            f"Top {self.top} allocation sites by growth during the pass:",
+            *(str(stat) for stat in after.compare_to(before, "lineno")[:self.top]),
+            "",
+            f"Top {self.top} allocation sites after the pass:",
+            *(str(stat) for stat in after.statistics("lineno")[:self.top]),
+        ]
+        self._write_report(f"{self._report_path('tracemalloc')}.txt", "\n".join(lines) + "\n")
+
+    def _report_path(self, kind: str) -> str:
+        return os.path.join(self.folder, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+
+    def _write_report(self, path: str, report: str) -> bool:
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(report)
+        except OSError as ex:
+            logger.warning(f"Profiling report could not be written to '{path}': {ex}")
+            return False
+        logger.info(f"Profiling report is written to '{path}'.")
+        return True
+
+
+profiler = Profiler(PROFILE_CYCLES, PROFILE_TOP, PROFILE_FOLDER)
+if PROFILE_ON_START:
+    profiler.request_profile()
+if TRACE_MALLOC_ON_START:
+    profiler.request_trace()
+
+
+def install_signal_handlers() -> None:
+    """Makes SIGUSR1 request a CPU profile and SIGUSR2 an allocation trace.
+
+    Signals are not available on Windows, the settings of `.env` are the only way there.
+    Must be called from a running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGUSR1, profiler.request_profile)
+        loop.add_signal_handler(signal.SIGUSR2, profiler.request_trace)
+    except (AttributeError, NotImplementedError):
+        logger.debug("Profiling can not be requested with signals on this platform.")
@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+from loguru import logger
+
+from config import TG_GLOBAL_RATE, TG_CHAT_RATE, TG_CHAT_BURST
+
+
+class TokenBucket:
+    """Token bucket refilled at a constant rate.
+
+    A request larger than the bucket is let through when the bucket is full,
+    leaving it in debt, so a media group is never blocked forever.
+
+    Args:
+        rate (float): Tokens added per second.
+        capacity (float): Maximum number of tokens.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, count: float, now: float) -> float:
+        """Returns the time (in seconds) until `count` tokens can be taken."""
+        self._refill(now)
+        missing = min(count, self.capacity) - self.tokens
+        return max(missing, 0) / self.rate
+
+    def take(self, count: float) -> None:
+        self.tokens -= count
+
+    def penalize(self, timeout: float, now: float) -> None:
+        """Blocks the bucket for `timeout` seconds and slows its refill down."""
+        self._refill(now)
+        self.rate = max(self.rate * 0.8, self.base_rate / 4)
+        self.tokens = min(self.tokens, 0) - timeout * self.rate
+
+    def recover(self) -> None:
+        """Brings the refill rate back towards the base one after a successful request."""
+        self.rate = min(self.base_rate, self.rate * 1.05)
+
+
+class TelegramRateLimiter:
+    """Paces outgoing Telegram requests below the flood limits of the Bot API.
+
+    Every request takes tokens from the global bucket and from the bucket of
+    its chat, a media group takes one token per message. A request waits only
+    for the buckets it needs, so a chat at its limit does not hold back the others.
+
+    Args:
+        global_rate (float): Messages per second for the whole bot.
+        chat_rate (float): Messages per minute for a single chat.
+        chat_burst (float): Messages a chat can get at once after a pause.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate / 60
+        self.chat_burst = chat_burst
+        self._chat_buckets: dict[str, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        key = str(chat_id)
+        if key not in self._chat_buckets:
+            self._chat_buckets[key] = TokenBucket(self.chat_rate, self.chat_burst)
+        return self._chat_buckets[key]
+
+    async def acquire(self, chat_id: int | str, count: int = 1) -> None:
+        """Waits until `count` messages can be sent to the chat.
+
+        Args:
+            chat_id (int | str): ID or username of the chat.
+            count (int, optional): Number of messages in the request. Defaults to 1.
+        """
+        chat_bucket = self._chat_bucket(chat_id)
+        while True:
+            now = time.monotonic()
+            delay = max(
+                self.global_bucket.delay(count, now),
+                chat_bucket.delay(count, now),
+            )
+            if delay <= 0:
+                self.global_bucket.take(count)
+                chat_bucket.take(count)
+                chat_bucket.recover()
+                return
+            await asyncio.sleep(delay)
+
+    def retry_after(self, chat_id: int | str, timeout: float) -> None:
+        """Applies `RetryAfter` received for the chat: blocks it and lowers its rate.
+
+        Args:
+            chat_id (int | str): ID or username of the chat.
+            timeout (float): Time (in seconds) Telegram asked to wait.
+        """
+        chat_bucket = self._chat_bucket(chat_id)
+        chat_bucket.penalize(timeout, time.monotonic())
+        logger.info(f"Rate for chat {chat_id} is lowered to {chat_bucket.rate * 60:.1f} messages per minute.")
+
+
+telegram_limiter = TelegramRateLimiter(TG_GLOBAL_RATE, TG_CHAT_RATE, TG_CHAT_BURST)
@@ -0,0 +1,75 @@
+import random
+import time
+from collections import OrderedDict
+from typing import Iterable
+
+from models import Post
+
+
+class PollScheduler:
+    """Chooses the time to sleep between polls of the wall from its posting rhythm.
+
+    The share of recent posts published at the current hour of the day tells how
+    likely a new post is: busy hours are polled close to the floor interval,
+    dead hours close to the ceiling. Every poll that finds nothing stretches
+    the interval further, a poll that finds a new post resets it.
+
+    Args:
+        min_interval (float): Floor of the interval (in seconds).
+        max_interval (float): Ceiling of the interval (in seconds).
+        jitter (float): Maximum relative deviation added to every interval.
+        history_size (int, optional): Number of recent posts to learn from. Defaults to 500.
+    """
+
+    def __init__(
+        self,
+        min_interval: float,
+        max_interval: float,
+        jitter: float,
+        history_size: int = 500
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.jitter = jitter
+        self.history_size = history_size
+        self.misses = 0
+        self._post_dates: OrderedDict[int, int] = OrderedDict()
+
+    def observe_posts(self, posts: Iterable[Post]) -> None:
+        """Remembers publication dates of the posts."""
+        for post in posts:
+            if post.date:
+                self._post_dates[post.id] = post.date
+                self._post_dates.move_to_end(post.id)
+        while len(self._post_dates) > self.history_size:
+            self._post_dates.popitem(last=False)
+
+    def record_poll(self, hit: bool) -> None:
+        """Records whether the poll has found a new post."""
+        self.misses = 0 if hit else self.misses + 1
+
+    def activity(self, timestamp: float) -> float:
+        """Returns how active the wall is at the hour of the timestamp,
+        relative to an average hour (1.0).
+        """
+        hour = time.localtime(timestamp).tm_hour
+        posts_in_hour = sum(
+            1 for date in self._post_dates.values()
+            if time.localtime(date).tm_hour == hour
+        )
+        return (posts_in_hour + 1) * 24 / (len(self._post_dates) + 24)
+
+    def next_delay(self, now: float | None = None) -> float:
+        """Returns the time (in seconds) to sleep before the next poll."""
+        if now is None:
+            now = time.time()
+        if self.misses == 0:
+            delay = self.min_interval
+        else:
+            # An hour twice as busy as the average one is polled at the floor.
+            score = min(self.activity(now) / 2, 1.0)
+            delay = self.max_interval * (self.min_interval / self.max_interval) ** score
+            delay *= 1.25 ** (self.misses - 1)
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return min(max(delay, self.min_interval), self.max_interval)
+
@@ -1,143 +1,337 @@
 import asyncio
-import os
-import requests
+import io
+from contextlib import contextmanager
+from typing import Iterator
 
+import aiohttp
 from aiogram import Bot, types
 from aiogram.utils import exceptions
 from loguru import logger
 
-import tools
+from cache import file_id_index
+import http_session
+import message_plan
+from metrics import metrics
+from rate_limiter import telegram_limiter
+from workspace import StoredFile
 
 
 MAX_DOC_SIZE = 20971520 # 20 Mb
 
+# Bot API methods of the planned calls.
+TELEGRAM_METHODS = {
+    "message": "sendMessage",
+    "photo": "sendPhoto",
+    "document": "sendDocument",
+    "media_group": "sendMediaGroup",
+}
+
 
 async def send_post(
     bot: Bot,
     tg_channel: str,
     text: str,
-    photos: list[str],
-    docs: list[dict[str, str]],
+    photos: list[dict[str, str]],
+    docs: list[dict[str, str|int|StoredFile|None]],
     num_tries: int = 0,
     avatar_update: bool = False
-) -> None:
-    num_tries += 1
-    if num_tries > 3:
-        logger.error("Post was not sent to Telegram. Too many tries.")
-        return
+) -> tuple[list[int], bool]:
+    """Sends the parsed post to Telegram.
+
+    The calls are planned once. A call that fails with a flood limit or a bad request
+    is retried, and the post is sent on from it, so the messages that have already
+    reached the channel are not sent again. The post gets 3 tries in total.
+
+    Returns:
+        tuple[list[int], bool]: IDs of the sent messages and whether the whole post was sent.
+    """
+    plan = plan_post(text, photos, docs)
+    message_ids: list[int] = []
+    sent = 0
+    while True:
+        num_tries += 1
+        if num_tries > 3:
+            logger.error(f"Post was not sent to Telegram. Too many tries. Sent messages: {message_ids}.")
+            return message_ids, False
+        try:
+            if avatar_update:
+                try:
+                    await update_avatar(bot, tg_channel, photos[0]["url"])
+                except exceptions.BadRequest as ex:
+                    logger.warning(f"The avatar was not updated: {ex}")
+                avatar_update = False
+            while sent < len(plan):
+                messages = await send_planned_message(bot, tg_channel, plan[sent])
+                message_ids += [message.message_id for message in messages]
+                sent += 1
+            logger.info(f"Post sent to Telegram with {len(plan)} requests.")
+            return message_ids, True
+        except exceptions.RetryAfter as ex:
+            logger.warning(
+                "Flood limit is exceeded. "
+                f"Chat is paused for {ex.timeout} seconds. "
+                f"Try: {num_tries}"
+            )
+            telegram_limiter.retry_after(tg_channel, ex.timeout)
+            metrics.inc("vktgbot_retry_after_seconds_total", ex.timeout)
+        except exceptions.BadRequest as ex:
+            forget_file_ids(plan[sent].media_type, plan[sent].media)
+            remaining_photos = [
+                photo for planned in plan[sent:] if planned.media_type == "photo"
+                for photo in planned.media
+            ]
+            if is_url_fetch_error(ex) and any("data" not in photo for photo in remaining_photos):
+                logger.warning(f"Telegram could not fetch the photos, uploading them. Try: {num_tries}. {ex}")
+                downloaded = await download_photos(remaining_photos)
+                plan[sent:] = replace_photos(plan[sent:], downloaded)
+                continue
+            plan[sent:] = replace_unsendable_docs(plan[sent:])
+            logger.warning(f"Bad request. Wait 60 seconds. Try: {num_tries}. {ex}")
+            await asyncio.sleep(60)
+
+
+async def update_avatar(bot: Bot, tg_channel: str, url: str) -> None:
+    """Sets the photo as the photo of the channel. A photo that could not be downloaded is skipped."""
     try:
-        if len(photos) == 0 and len(docs) == 0:
-            await send_text_post(bot, tg_channel, text)
-        elif len(photos) == 1:
-            await send_photo_post(bot, tg_channel, text, photos, avatar_update=avatar_update)
-        elif len(photos) >= 2:
-            await send_photos_post(bot, tg_channel, text, photos)
-        if docs and len(photos) == 0:
-            await send_docs_post(bot, tg_channel, docs, caption=text)
-        elif docs:
-            await send_docs_post(bot, tg_channel, docs)
-    except exceptions.RetryAfter as ex:
-        logger.warning(
-            "Flood limit is exceeded. "
-            f"Sleep {ex.timeout + 10} seconds. "
-            f"Try: {num_tries}"
+        avatar = await http_session.get_bytes(url)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+        logger.warning(f"The avatar could not be downloaded: {ex}")
+        return
+    await telegram_limiter.acquire(tg_channel)
+    with counted_call("setChatPhoto"):
+        await bot.set_chat_photo(
+            tg_channel,
+            types.InputFile(io.BytesIO(avatar), filename="avatar.jpg")
         )
-        await asyncio.sleep(ex.timeout + 10)
-        await send_post(bot, tg_channel, text, photos, docs, num_tries)
-    except exceptions.BadRequest as ex:
-        logger.warning(f"Bad request. Wait 60 seconds. Try: {num_tries}. {ex}")
-        await asyncio.sleep(60)
-        await send_post(bot, tg_channel, text, photos, docs, num_tries)
 
 
-async def send_text_post(bot: Bot, tg_channel: str, text: str) -> None:
-    if not text:
-        return
+def plan_post(
+    text: str,
+    photos: list[dict[str, str]],
+    docs: list[dict[str, str|int|StoredFile|None]]
+) -> list[message_plan.PlannedMessage]:
+    """Plans the calls of the post. Documents that can be neither uploaded nor sent by file_id are sent as links."""
+    sendable_docs = [doc for doc in docs if is_sendable_doc(doc)]
+    link_docs = [doc["url"] for doc in docs if doc not in sendable_docs]
+    if link_docs:
+        text = "\n".join([text, *link_docs]) if text else "\n".join(link_docs)
+    return message_plan.plan_messages(text, photos, sendable_docs)
 
-    if len(text) < 4096:
-        await bot.send_message(tg_channel, text, parse_mode=types.ParseMode.HTML)
-    else:
-        text_parts = tools.split_text(text, 4084)
-        prepared_text_parts = (
-            [text_parts[0] + " (...)"]
-            + ["(...) " + part + " (...)" for part in text_parts[1:-1]]
-            + ["(...) " + text_parts[-1]]
-        )
 
-        for part in prepared_text_parts:
-            await bot.send_message(tg_channel, part, parse_mode=types.ParseMode.HTML)
-            await asyncio.sleep(0.5)
-    logger.info("Text post sent to Telegram.")
+def is_sendable_doc(doc: dict) -> bool:
+    return bool(doc["file"] or get_file_id("document", doc))
 
 
-async def send_photo_post(
-    bot: Bot,
-    tg_channel: str,
-    text: str,
-    photos: list[str],
-    avatar_update: bool = False
-) -> None:
-    if avatar_update:
-        await bot.set_chat_photo(
-            tg_channel,
-            types.InputFile(
-                requests.get(photos[0], stream=True).raw,
-                filename="avatar.jpg"
+def replace_media(
+    planned_message: message_plan.PlannedMessage,
+    media: list[dict]
+) -> message_plan.PlannedMessage | None:
+    """Returns the planned call with other media of the same type, or None if nothing is left to send."""
+    if media:
+        method = planned_message.media_type if len(media) == 1 else "media_group"
+        return message_plan.PlannedMessage(method, planned_message.text, media, planned_message.media_type)
+    if planned_message.text:
+        return message_plan.PlannedMessage("message", planned_message.text)
+    return None
+
+
+def replace_photos(
+    plan: list[message_plan.PlannedMessage],
+    photos: list[dict]
+) -> list[message_plan.PlannedMessage]:
+    """Replaces the photos of the planned calls with their downloaded copies.
+
+    Photos that could not be downloaded are dropped.
+    """
+    downloaded = {photo["key"]: photo for photo in photos}
+    replanned = []
+    for planned_message in plan:
+        if planned_message.media_type == "photo":
+            planned_message = replace_media(planned_message, [
+                downloaded[photo["key"]] for photo in planned_message.media if photo["key"] in downloaded
+            ])
+        if planned_message is not None:
+            replanned.append(planned_message)
+    return replanned
+
+
+def replace_unsendable_docs(plan: list[message_plan.PlannedMessage]) -> list[message_plan.PlannedMessage]:
+    """Moves documents of the planned calls that lost their file_ids and have no file to a message with their links."""
+    replanned = []
+    link_docs = []
+    for planned_message in plan:
+        if planned_message.media_type == "document":
+            link_docs += [doc["url"] for doc in planned_message.media if not is_sendable_doc(doc)]
+            planned_message = replace_media(
+                planned_message, [doc for doc in planned_message.media if is_sendable_doc(doc)]
             )
-        )
-    if len(text) <= 1024:
-        await bot.send_photo(tg_channel, photos[0], text, parse_mode=types.ParseMode.HTML)
-        logger.info("Text post (<=1024) with photo sent to Telegram.")
-    else:
-        prepared_text = f'<a href="{photos[0]}"> </a>{text}'
-        if len(prepared_text) <= 4096:
-            await bot.send_message(tg_channel, prepared_text, parse_mode=types.ParseMode.HTML)
-        else:
-            await send_text_post(bot, tg_channel, text)
-            await bot.send_photo(tg_channel, photos[0])
-        logger.info("Text post (>1024) with photo sent to Telegram.")
-
-
-async def send_photos_post(bot: Bot, tg_channel: str, text: str, photos: list[str]) -> None:
-    media = types.MediaGroup()
-    for photo in photos:
-        media.attach_photo(types.InputMediaPhoto(photo))
-
-    if (len(text) > 0) and (len(text) <= 1024):
-        media.media[0].caption = text
-        media.media[0].parse_mode = types.ParseMode.HTML
-    elif len(text) > 1024:
-        await send_text_post(bot, tg_channel, text)
-    await bot.send_media_group(tg_channel, media)
-    logger.info("Text post with photos sent to Telegram.")
-
-
-async def send_docs_post(
+        if planned_message is not None:
+            replanned.append(planned_message)
+    if link_docs:
+        replanned.append(message_plan.PlannedMessage("message", "\n".join(link_docs)))
+    return replanned
+
+
+async def send_planned_message(
     bot: Bot,
     tg_channel: str,
-    docs: list[dict[str, str]],
-    caption: str = ""
-) -> None:
-    media = types.MediaGroup()
+    planned_message: message_plan.PlannedMessage
+) -> list[types.Message]:
+    """Makes the planned Telegram call.
+
+    Args:
+        bot (Bot): Telegram bot.
+        tg_channel (str): Telegram channel.
+        planned_message (message_plan.PlannedMessage): Planned call.
+
+    Returns:
+        list[types.Message]: Sent messages.
+    """
+    caption = planned_message.text or None
+    await telegram_limiter.acquire(tg_channel, max(len(planned_message.media), 1))
+    if planned_message.method == "message":
+        with counted_call("sendMessage"):
+            return [
+                await bot.send_message(tg_channel, planned_message.text, parse_mode=types.ParseMode.HTML)
+            ]
+
     opened_docs = []
-    for doc in docs:
-        doc_filepath = f"./temp/{tools.slug_filename(doc['title'])}"
-        if os.path.getsize(doc_filepath) > MAX_DOC_SIZE:
-            caption = f"{caption}\n{doc['url']}"
-        else:
-            doc_file = open(doc_filepath, "rb")
-            opened_docs.append(doc_file)
-            media.attach_document(types.InputMediaDocument(doc_file))
-
-    if caption:
-        if media and (len(caption) > 0) and (len(caption) <= 1024):
-            media.media[0].caption = caption
-            media.media[0].parse_mode = types.ParseMode.HTML
-        elif not media or len(caption) > 1024:
-            await send_text_post(bot, tg_channel, caption)
+    try:
+        sources = []
+        for item in planned_message.media:
+            if planned_message.media_type == "photo":
+                sources.append(get_photo_source(item))
+            else:
+                source = get_file_id("document", item)
+                if not source:
+                    doc_file = item["file"].open()
+                    opened_docs.append(doc_file)
+                    source = types.InputFile(doc_file, filename=item["file"].name)
+                sources.append(source)
 
-    if media:
-        await bot.send_media_group(tg_channel, media)
-    for doc_file in opened_docs:
-        doc_file.close()
-    logger.info("Documents sent to Telegram.")
+        with counted_call(TELEGRAM_METHODS[planned_message.method]):
+            if planned_message.method == "photo":
+                messages = [await bot.send_photo(
+                    tg_channel, sources[0], caption, parse_mode=types.ParseMode.HTML
+                )]
+            elif planned_message.method == "document":
+                messages = [await bot.send_document(
+                    tg_channel, sources[0], caption=caption, parse_mode=types.ParseMode.HTML
+                )]
+            else:
+                media = types.MediaGroup()
+                for source in sources:
+                    if planned_message.media_type == "photo":
+                        media.attach_photo(types.InputMediaPhoto(source))
+                    else:
+                        media.attach_document(types.InputMediaDocument(source))
+                if caption:
+                    media.media[0].caption = caption
+                    media.media[0].parse_mode = types.ParseMode.HTML
+                messages = await bot.send_media_group(tg_channel, media)
+    finally:
+        for doc_file in opened_docs:
+            doc_file.close()
+
+    remember_file_ids(planned_message.media_type, planned_message.media, messages)
+    return messages
+
+
+@contextmanager
+def counted_call(method: str) -> Iterator[None]:
+    """Counts the Telegram call made in the block by its outcome."""
+    try:
+        yield
+    except exceptions.RetryAfter:
+        metrics.inc("vktgbot_telegram_calls_total", method=method, outcome="retry_after")
+        raise
+    except exceptions.BadRequest:
+        metrics.inc("vktgbot_telegram_calls_total", method=method, outcome="bad_request")
+        raise
+    except Exception:
+        metrics.inc("vktgbot_telegram_calls_total", method=method, outcome="error")
+        raise
+    metrics.inc("vktgbot_telegram_calls_total", method=method, outcome="ok")
+
+
+def get_file_id(kind: str, media: dict) -> str | None:
+    """Returns Telegram file_id of the media if it has already been sent.
+
+    Args:
+        kind (str): Kind of the media: "photo" or "document".
+        media (dict): Parsed photo or document with the "key" of the VK media.
+
+    Returns:
+        str | None: file_id, or None if the media has to be uploaded.
+    """
+    return file_id_index.get(kind, media["key"])
+
+
+def get_photo_source(photo: dict) -> str | types.InputFile:
+    """Returns what Telegram gets the photo from: its downloaded bytes, file_id or URL."""
+    if "data" in photo:
+        return types.InputFile(io.BytesIO(photo["data"]), filename=f'{photo["key"]}.jpg')
+    return get_file_id("photo", photo) or photo["url"]
+
+
+def is_url_fetch_error(ex: exceptions.BadRequest) -> bool:
+    """Checks if Telegram failed to fetch the media by its URL."""
+    if isinstance(ex, (exceptions.InvalidHTTPUrlContent, exceptions.WrongFileIdentifier)):
+        return True
+    message = str(ex).lower()
+    return any(
+        error in message
+        for error in ("web page", "webpage_curl_failed", "webpage_media_empty")
+    )
+
+
+async def download_photos(photos: list[dict]) -> list[dict]:
+    """Downloads the photos concurrently to upload them as bytes.
+
+    Photos that could not be downloaded are dropped, so the rest of the post is still sent.
+
+    Args:
+        photos (list[dict]): Parsed photos of the post.
+
+    Returns:
+        list[dict]: Photos with their bytes in "data".
+    """
+    downloaded = await asyncio.gather(*(download_photo(photo) for photo in photos))
+    return [photo for photo in downloaded if photo]
+
+
+async def download_photo(photo: dict) -> dict | None:
+    if "data" in photo:
+        return photo
+    try:
+        data = await http_session.get_bytes(photo["url"])
+    except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+        logger.warning(f"The photo could not be downloaded: {ex}")
+        return None
+    return {**photo, "data": data}
+
+
+def remember_file_ids(kind: str, media: list[dict], messages: list[types.Message]) -> None:
+    """Stores file_ids of the sent media to reuse them instead of uploading the media again.
+
+    Args:
+        kind (str): Kind of the media: "photo" or "document".
+        media (list[dict]): Parsed photos or documents in the order they were sent.
+        messages (list[types.Message]): Messages returned by Telegram.
+    """
+    for item, message in zip(media, messages):
+        if kind == "photo" and message.photo:
+            file_id_index.set(kind, item["key"], message.photo[-1].file_id)
+        elif kind == "document" and message.document:
+            file_id_index.set(kind, item["key"], message.document.file_id)
+
+
+def forget_file_ids(kind: str, media: list[dict]) -> None:
+    """Drops stored file_ids of the media, so it is sent from the source next time.
+
+    Args:
+        kind (str): Kind of the media: "photo" or "document".
+        media (list[dict]): Parsed photos or documents.
+    """
+    for item in media:
+        file_id_index.delete(kind, item["key"])
@@ -0,0 +1,101 @@
+import json
+from dataclasses import dataclass, field
+
+import config
+from keyword_filter import KeywordFilter
+from scheduler import PollScheduler
+import tools
+
+
+@dataclass
+class Channel:
+    """Telegram channel of the source with its own word filters."""
+
+    tg_channel: str
+    whitelist: list = field(default_factory=list)
+    blacklist: list = field(default_factory=list)
+    whitelist_filter: KeywordFilter = field(init=False, repr=False)
+    blacklist_filter: KeywordFilter = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.whitelist_filter = KeywordFilter(self.whitelist)
+        self.blacklist_filter = KeywordFilter(self.blacklist)
+
+
+@dataclass
+class Source:
+    """VK community mirrored to a Telegram channel, with its own settings.
+
+    Settings that are not given fall back to the global ones from `.env`.
+    `name` identifies the state of the source and defaults to `vk_domain`,
+    `last_id` is the ID of the last post that must not be sent, used on the first start.
+    `tg_channel` is a channel or a list of channels, given by their IDs or as objects
+    with "tg_channel", "whitelist" and "blacklist" keys. A post is fetched and
+    parsed once for all of them.
+    """
+
+    vk_domain: str
+    tg_channel: str | list
+    name: str = ""
+    last_id: int = 0
+    req_count: int = config.REQ_COUNT
+    req_filter: str = config.REQ_FILTER
+    whitelist: list = field(default_factory=lambda: list(config.WHITELIST))
+    blacklist: list = field(default_factory=lambda: list(config.BLACKLIST))
+    skip_ads_posts: bool = config.SKIP_ADS_POSTS
+    skip_copyrighted_post: bool = config.SKIP_COPYRIGHTED_POST
+    skip_reposts: bool = config.SKIP_REPOSTS
+    show_original_post_link: bool = config.SHOW_ORIGINAL_POST_LINK
+    long_poll_token: str = config.VK_LONG_POLL_TOKEN
+    scheduler: PollScheduler = field(
+        default_factory=lambda: PollScheduler(
+            config.MIN_TIME_TO_SLEEP,
+            config.MAX_TIME_TO_SLEEP,
+            config.SLEEP_JITTER,
+        ),
+        repr=False,
+    )
+    channels: list[Channel] = field(default_factory=list, init=False, repr=False)
+    whitelist_filter: KeywordFilter = field(init=False, repr=False)
+    blacklist_filter: KeywordFilter = field(init=False, repr=False)
+
+    def __post_init__(self):
+        if not self.name:
+            self.name = self.vk_domain
+        self.whitelist_filter = KeywordFilter(self.whitelist)
+        self.blacklist_filter = KeywordFilter(self.blacklist)
+        tg_channels = self.tg_channel if isinstance(self.tg_channel, list) else [self.tg_channel]
+        self.channels = [
+            Channel(**channel) if isinstance(channel, dict) else Channel(channel)
+            for channel in tg_channels
+        ]
+        if not self.channels:
+            raise ValueError(f"Source {self.name} has no Telegram channels.")
+
+    @property
+    def temp_folder(self) -> str:
+        return f"./temp/{tools.slug_filename(self.name)}"
+
+
+def load_sources() -> list[Source]:
+    """Loads sources from `VAR_SOURCES` or from the file `VAR_SOURCES_FILE`.
+
+    If none of them is set, the only source is built from
+    `VAR_VK_DOMAIN` and `VAR_TG_CHANNEL`.
+
+    Returns:
+        list[Source]: Configured sources.
+    """
+    sources_config = config.SOURCES
+    if config.SOURCES_FILE:
+        with open(config.SOURCES_FILE, "r", encoding="utf-8") as file:
+            sources_config = json.load(file)
+    if not sources_config:
+        return [Source(config.VK_DOMAIN, config.TG_CHANNEL)]
+
+    sources = [Source(**source_config) for source_config in sources_config]
+    names = [source.name for source in sources]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Sources must have unique names: {', '.join(sorted(duplicates))}.")
+    return sources
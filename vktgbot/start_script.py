@@ -1,113 +1,328 @@
+import asyncio
+import time
 from typing import Union
 
-from aiogram import Bot, Dispatcher
-from aiogram.utils import executor
+from aiogram import Bot
 from loguru import logger
 
 import config
+from config import PARSE_CONCURRENCY, PIPELINE_DEPTH
 import api_requests
-from last_id import read_id, write_id, read_known_id, write_known_id
-from parse_posts import parse_post
+from last_id import (
+    read_id, write_id, read_known_id, write_known_id, read_post_status, write_post_status
+)
+from metrics import metrics
+from models import Post
+from parse_posts import parse_post, resolve_window
 from send_posts import send_post
+from sources import Channel, Source
 import tools
+from workspace import TempScope, temp_workspace
 
 
-def start_script():
-    bot = Bot(token=config.TG_BOT_TOKEN)
-    dp = Dispatcher(bot)
-
-    last_known_id = read_known_id()
-    last_wall_id = read_id()
-    logger.info(f"Last known ID: {last_known_id}")
+async def start_script(bot: Bot, source: Source):
+    last_known_id = read_known_id(source.name)
+    last_wall_id = read_id(source.name)
+    logger.info(f"[{source.name}] Last known ID: {last_known_id}")
 
     if int(last_known_id) >= int(last_wall_id):
-        last_wall_id = api_requests.get_last_id(
+        with metrics.time("vktgbot_stage_seconds", stage="vk_poll"):
+            last_wall_id = await api_requests.get_last_id(
+                config.VK_TOKEN,
+                config.REQ_VERSION,
+                source.vk_domain,
+                source.req_filter
+            )
+        if last_wall_id:
+            write_id(source.name, last_wall_id)
+        has_new_posts = bool(last_wall_id) and last_wall_id > last_known_id
+        source.scheduler.record_poll(has_new_posts)
+        if has_new_posts:
+            return 1
+        return
+
+    with metrics.time("vktgbot_stage_seconds", stage="vk_fetch"):
+        items: Union[list[Post], None] = await api_requests.get_data_from_vk(
             config.VK_TOKEN,
             config.REQ_VERSION,
-            config.VK_DOMAIN,
-            config.REQ_FILTER
+            source.vk_domain,
+            req_count=source.req_count,
+            req_start_post_id=int(last_known_id)+1
         )
-        if last_wall_id:
-            write_id(last_wall_id)
+    if items is None:
+        # The window is fetched again on the next pass, so its posts are not lost.
+        logger.warning(f"[{source.name}] Posts after ID {last_known_id} were not fetched from VK.")
         return
-
-    items: Union[dict, None] = api_requests.get_data_from_vk(
-        config.VK_TOKEN,
-        config.REQ_VERSION,
-        config.VK_DOMAIN,
-        req_count=config.REQ_COUNT,
-        req_start_post_id=int(last_known_id)+1
-    )
     if not items:
-        new_last_id: int = int(last_known_id)+config.REQ_COUNT
-        write_known_id(new_last_id)
+        new_last_id: int = int(last_known_id)+source.req_count
+        write_known_id(source.name, new_last_id)
 
         return 1
 
-    logger.info(f"Got a few posts with IDs: {items[0]['id']} - {items[-1]['id']}.")
+    logger.info(f"Got a few posts with IDs: {items[0].id} - {items[-1].id}.")
+    source.scheduler.observe_posts(items)
 
-    new_last_id: int = items[-1]["id"]
+    new_last_id: int = items[-1].id
 
     if new_last_id > last_known_id:
-        for item in items:
-            item: dict
-            if item["id"] <= last_known_id:
-                continue
-            logger.info(f"Working with post with ID: {item['id']}.")
-            if item.get("is_deleted", False) is True:
-                logger.info(f"Post was deleted: {item['deleted_reason']}.")
-                continue
-            if tools.blacklist_check(config.BLACKLIST, item["text"]):
-                continue
-            if tools.whitelist_check(config.WHITELIST, item["text"]):
-                continue
-            if config.SKIP_ADS_POSTS and item.get("marked_as_ads", False):
-                logger.info("Post was skipped as an advertisement.")
-                continue
-            if config.SKIP_COPYRIGHTED_POST and item.get("copyright", None):
-                logger.info("Post was skipped as an copyrighted post.")
+        await send_new_posts(bot, source, items, last_known_id)
+        write_known_id(source.name, new_last_id)
+
+
+async def send_new_posts(bot: Bot, source: Source, items: list[Post], last_known_id: int) -> None:
+    posts: list[Post] = []
+    channels: dict[int, list[Channel]] = {}
+    for item in items:
+        if item.id <= last_known_id:
+            continue
+        logger.info(f"Working with post with ID: {item.id}.")
+        status = read_post_status(source.name, item.id, "post")
+        if status in ("skipped", "failed"):
+            continue
+        channels[item.id] = [
+            channel for channel in source.channels
+            if not is_skipped_by_channel(item, channel)
+        ]
+        if status is None:
+            if is_skipped(item, source) or not channels[item.id]:
+                write_post_status(source.name, item.id, "post", "skipped")
                 continue
+            write_post_status(source.name, item.id, "post", "fetched")
+        posts.append(item)
 
-            item_parts = {"post": item}
-            group_name = ""
-            if item.get("copy_history", None) and not config.SKIP_REPOSTS:
-                item_parts["repost"] = item["copy_history"][0]
-                if item_parts["repost"]["owner_id"] < 0:
-                    group_name = api_requests.get_group_name(
-                        config.VK_TOKEN,
-                        config.REQ_VERSION,
-                        abs(item_parts["repost"]["owner_id"]),
-                    )
-                else:
-                    group_name = api_requests.get_user_name(
-                        config.VK_TOKEN,
-                        config.REQ_VERSION,
-                        item_parts["repost"]["owner_id"],
+    resolved = await resolve_window(posts, source.skip_reposts)
+
+    # Posts are parsed and their documents downloaded ahead of sending,
+    # while the queue keeps them in the order of their IDs.
+    queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_DEPTH)
+    producer = asyncio.create_task(
+        queue_prepared_posts(queue, source, posts, channels, resolved)
+    )
+    try:
+        while (entry := await queue.get()) is not None:
+            item, prepared = entry
+            sent = False
+            parts = await prepared
+            try:
+                for item_part_key, parsed_post, pending_channels, scope in parts:
+                    logger.info(f"Starting sending of the {item_part_key} with ID: {item.id}.")
+                    # The first channel uploads the media, the others reuse its file_ids.
+                    delivered = [await send_to_channel(
+                        bot, source, item.id, item_part_key, parsed_post, pending_channels[0]
+                    )]
+                    delivered += await asyncio.gather(*(
+                        send_to_channel(bot, source, item.id, item_part_key, parsed_post, channel)
+                        for channel in pending_channels[1:]
+                    ))
+                    write_post_status(
+                        source.name,
+                        item.id,
+                        item_part_key,
+                        "sent" if all(delivered) else "failed"
                     )
-                logger.info("Detected repost in the post.")
+                    scope.close()
+                    sent = sent or any(delivered)
+            finally:
+                close_scopes(parts)
+
+            write_known_id(source.name, item.id)
+            if sent and item.date:
+                metrics.observe("vktgbot_publish_lag_seconds", time.time() - item.date, source=source.name)
+            update_backlog(source)
+    finally:
+        producer.cancel()
+        while not queue.empty():
+            entry = queue.get_nowait()
+            if entry is not None:
+                drop_prepared(entry[1])
+
+
+async def queue_prepared_posts(
+    queue: asyncio.Queue,
+    source: Source,
+    posts: list[Post],
+    channels: dict[int, list[Channel]],
+    resolved: dict[str, dict]
+) -> None:
+    """Starts preparing the posts in order and puts them to the queue with their tasks.
+
+    The queue is bounded, so preparing stops when the sending falls behind.
+    At most `VAR_PARSE_CONCURRENCY` posts are parsed at the same time.
+    The end of the posts is marked with None.
+    """
+    semaphore = asyncio.Semaphore(PARSE_CONCURRENCY)
+    for item in posts:
+        prepared = asyncio.create_task(
+            prepare_post(source, item, channels[item.id], resolved, semaphore)
+        )
+        try:
+            await queue.put((item, prepared))
+        except asyncio.CancelledError:
+            drop_prepared(prepared)
+            raise
+    await queue.put(None)
+
+
+def drop_prepared(prepared: asyncio.Task) -> None:
+    """Cancels preparing of the post that will not be sent and removes its downloaded files."""
+    prepared.cancel()
+    prepared.add_done_callback(close_prepared_scopes)
+
+
+def close_prepared_scopes(prepared: asyncio.Task) -> None:
+    # The task closes its scopes itself if it is cancelled or fails.
+    if not prepared.cancelled() and prepared.exception() is None:
+        close_scopes(prepared.result())
 
+
+def close_scopes(parts: list[tuple[str, dict, list[Channel], TempScope]]) -> None:
+    for *_, scope in parts:
+        scope.close()
+
+
+async def prepare_post(
+    source: Source,
+    item: Post,
+    channels: list[Channel],
+    resolved: dict[str, dict],
+    semaphore: asyncio.Semaphore
+) -> list[tuple[str, dict, list[Channel], TempScope]]:
+    """Parses the parts of the post that have not been sent to all channels yet.
+
+    Every part gets its own temp scope, so documents of the following
+    posts can be downloaded while the previous ones are being sent.
+    The scopes must be closed once the parts are sent.
+
+    Returns:
+        list[tuple[str, dict, list[Channel], TempScope]]: Key of the part, parsed part,
+            channels it must be sent to and its temp scope.
+    """
+    item_parts = {"post": item}
+    group_name = ""
+    if item.copy_history and not source.skip_reposts:
+        item_parts["repost"] = item.copy_history[0]
+        group_name = resolved["names"].get(item_parts["repost"].owner_id, "")
+        logger.info("Detected repost in the post.")
+
+    prepared = []
+    scopes = []
+    async with semaphore:
+        try:
             for item_part_key, item_part in item_parts.items():
-                tools.prepare_temp_folder()
+                if read_post_status(source.name, item.id, item_part_key) == "sent":
+                    logger.info(f"The {item_part_key} was already sent to Telegram.")
+                    continue
+                pending_channels = [
+                    channel for channel in channels
+                    if read_post_status(
+                        source.name, item.id, channel_part(item_part_key, channel)
+                    ) != "sent"
+                ]
+                if not pending_channels:
+                    write_post_status(source.name, item.id, item_part_key, "sent")
+                    continue
+                scope = temp_workspace.scope(f"{source.temp_folder}/{item.id}_{item_part_key}")
+                scopes.append(scope)
                 repost_exists = len(item_parts) > 1
 
-                logger.info(f"Starting parsing of the {item_part_key}")
-                parsed_post = parse_post(
-                    item_part,
-                    repost_exists,
-                    item_part_key,
-                    group_name
-                )
-                logger.info(f"Starting sending of the {item_part_key}")
-                executor.start(
-                    dp,
-                    send_post(
-                        bot,
-                        config.TG_CHANNEL,
-                        parsed_post["text"],
-                        parsed_post["photos"],
-                        parsed_post["docs"],
-                        avatar_update = parsed_post["avatar_update"]
-                    ),
-                )
-
-        write_known_id(new_last_id)
+                logger.info(f"Starting parsing of the {item_part_key} with ID: {item.id}.")
+                with metrics.time("vktgbot_stage_seconds", stage="parse_post"):
+                    parsed_post = await parse_post(
+                        item_part,
+                        repost_exists,
+                        item_part_key,
+                        group_name,
+                        resolved["videos"],
+                        show_original_post_link=source.show_original_post_link,
+                        scope=scope
+                    )
+                write_post_status(source.name, item.id, item_part_key, "parsed")
+                prepared.append((item_part_key, parsed_post, pending_channels, scope))
+        except BaseException:
+            for scope in scopes:
+                scope.close()
+            raise
+    return prepared
+
+
+async def send_to_channel(
+    bot: Bot,
+    source: Source,
+    post_id: int,
+    part: str,
+    parsed_post: dict,
+    channel: Channel
+) -> bool:
+    """Sends the parsed part of the post to the channel and records the result in the journal.
+
+    IDs of the messages that reached the channel are recorded even if the part was not sent completely.
+
+    Returns:
+        bool: True if the part was sent, False otherwise.
+    """
+    with metrics.time("vktgbot_stage_seconds", stage="send_post"):
+        message_ids, complete = await send_post(
+            bot,
+            channel.tg_channel,
+            parsed_post["text"],
+            parsed_post["photos"],
+            parsed_post["docs"],
+            avatar_update = parsed_post["avatar_update"]
+        )
+    write_post_status(
+        source.name,
+        post_id,
+        channel_part(part, channel),
+        "sent" if complete else "failed",
+        message_ids or None
+    )
+    return complete
+
+
+def update_backlog(source: Source) -> None:
+    """Records how far the source is behind the wall in the metrics."""
+    if metrics.enabled:
+        metrics.set(
+            "vktgbot_backlog_posts",
+            max(read_id(source.name) - read_known_id(source.name), 0),
+            source=source.name
+        )
+
+
+def channel_part(part: str, channel: Channel) -> str:
+    """Returns the key of the delivery of the post part to the channel in the journal."""
+    return f"{part}@{channel.tg_channel}"
+
+
+def is_skipped_by_channel(item: Post, channel: Channel) -> bool:
+    """Checks if the post must not be sent to the channel according to its word filters."""
+    return (
+        tools.blacklist_check(channel.blacklist_filter, item.text)
+        or tools.whitelist_check(channel.whitelist_filter, item.text)
+    )
+
+
+def is_skipped(item: Post, source: Source) -> bool:
+    """Checks if the post must not be sent according to the settings of the source.
+
+    Args:
+        item (Post): Post from VK.
+        source (Source): Source of the post.
+
+    Returns:
+        bool: True if the post is skipped, False otherwise.
+    """
+    if item.is_deleted:
+        logger.info(f"Post was deleted: {item.deleted_reason}.")
+        return True
+    if tools.blacklist_check(source.blacklist_filter, item.text):
+        return True
+    if tools.whitelist_check(source.whitelist_filter, item.text):
+        return True
+    if source.skip_ads_posts and item.marked_as_ads:
+        logger.info("Post was skipped as an advertisement.")
+        return True
+    if source.skip_copyrighted_post and item.copyright:
+        logger.info("Post was skipped as an copyrighted post.")
+        return True
+    return False
@@ -1,77 +1,84 @@
 import os
 import re
-import shutil
 
 from loguru import logger
 
+from keyword_filter import KeywordFilter
+from models import Post
 
-def blacklist_check(blacklist: list | None, text: str) -> bool:
+
+# The text of a link stops at brackets and line ends, so an unclosed link
+# is rejected at the next bracket instead of after scanning the rest of the text.
+VK_LINK_PATTERN = re.compile(r"\[([\w.:/]+?)\|([^\[\]\n]+)\]")
+# Bare URL in the HTML-escaped text.
+URL_PATTERN = re.compile(r"https?://(?:[^\s&\[\]]|&amp;)+")
+URL_TRAILING_CHARS = ".,:;!?)'"
+
+
+def blacklist_check(blacklist: KeywordFilter, text: str) -> bool:
     """Checks if the text contains blacklisted words.
 
     Args:
-        blacklist (list | None): List of blacklisted words.
+        blacklist (KeywordFilter): Compiled blacklist.
         text (str): Text to check.
 
     Returns:
         bool: True if the text contains blacklisted words, False otherwise.
     """
     if blacklist:
-        text_lower = text.lower()
-        for black_word in blacklist:
-            if black_word.lower() in text_lower:
-                logger.info(
-                    "Post was skipped due to the detection of blacklisted word: "
-                    f"{black_word}."
-                )
-                return True
+        black_word = blacklist.search(text)
+        if black_word is not None:
+            logger.info(
+                "Post was skipped due to the detection of blacklisted word: "
+                f"{black_word}."
+            )
+            return True
 
     return False
 
 
-def whitelist_check(whitelist: list | None, text: str) -> bool:
+def whitelist_check(whitelist: KeywordFilter, text: str) -> bool:
     """Checks if the text contains whitelisted words.
 
     Args:
-        whitelist (list | None): List of whitelisted words.
+        whitelist (KeywordFilter): Compiled whitelist.
         text (str): Text to check.
 
     Returns:
         bool: True if the text contains whitelisted words, False otherwise.
     """
     if whitelist:
-        text_lower = text.lower()
-        for white_word in whitelist:
-            if white_word.lower() in text_lower:
-                return False
+        white_word = whitelist.search(text)
+        if white_word is not None:
+            logger.debug(f"Whitelisted word was found: {white_word}.")
+            return False
         logger.info("The post was skipped because no whitelist words were found.")
         return True
 
     return False
 
 
-def prepare_folder(subfolder_name: str, root_folder: str | None = None):
-    """Creates temp folder if it does not exist or clears it if it does.
+def folder_size(path: str) -> int:
+    """Returns the total size (in bytes) of the files in the folder and its subfolders.
 
-    Args:
-        subfolder_name (str): Name of the subfolder.
-        root_folder (str | None, optional): Root folder. Defaults to None.
+    Files removed while the folder is being walked are not counted.
     """
-    path = f"./{root_folder}/{subfolder_name}" if root_folder else f"./{subfolder_name}"
-    if subfolder_name in os.listdir(root_folder):
-        shutil.rmtree(path)
-    os.mkdir(path)
-
-
-def prepare_temp_folder():
-    return prepare_folder("temp")
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
 
 
-def prepare_text_for_reposts(text: str, item: dict, item_type: str, group_name: str) -> str:
+def prepare_text_for_reposts(text: str, item: Post, item_type: str, group_name: str) -> str:
     """Prepares text for reposts.
 
     Args:
         text (str): Text to prepare.
-        item (dict): Item of the post.
+        item (Post): Item of the post.
         item_type (str): Type of the item.
         group_name (str): Name of the group.
 
@@ -79,13 +86,13 @@ def prepare_text_for_reposts(text: str, item: dict, item_type: str, group_name:
         str: Prepared text.
     """
     if item_type == "post" and text:
-        from_id = item["copy_history"][0]["from_id"]
-        post_id = item["copy_history"][0]["id"]
+        from_id = item.copy_history[0].from_id
+        post_id = item.copy_history[0].id
         link_to_repost = f"https://vk.com/wall{from_id}_{post_id}"
         text = f'{text}\n\n<a href="{link_to_repost}"><b>REPOST ↓ {prepare_text_for_html(group_name)}</b></a>'
     if item_type == "repost":
-        from_id = item["from_id"]
-        post_id = item["id"]
+        from_id = item.from_id
+        post_id = item.id
         link_to_repost = f"https://vk.com/wall{from_id}_{post_id}"
         text = f'<a href="{link_to_repost}"><b>REPOST ↓ {prepare_text_for_html(group_name)}</b></a>\n\n{text}'
 
@@ -110,66 +117,58 @@ def prepare_text_for_html(text: str) -> str:
     )
 
 
-def add_urls_to_text(text: str, urls: list, videos: list) -> str:
-    """Adds URLs to the text.
+def render_vk_text(text: str) -> tuple[str, set[str]]:
+    """Renders the text of a VK post to Telegram HTML.
+
+    VK links like `[id1|Pavel]` are converted to HTML links by a single
+    substitution, so the time grows linearly with the text regardless of
+    the number of links. URLs the text already contains are collected
+    to check the URLs of attachments against them.
 
     Args:
-        text (str): Text to add URLs to.
-        urls (list): List of URLs.
-        videos (list): List of URLs to videos.
+        text (str): Text of the post.
 
     Returns:
-        str: Text with URLs.
+        tuple[str, set[str]]: Rendered text and URLs it already contains.
     """
-    first_link = True
-    urls = videos + urls
+    known_urls: set[str] = set()
 
-    if not urls:
-        return text
+    def render_link(match: re.Match) -> str:
+        href = f"https://vk.com/{match[1]}"
+        known_urls.add(href)
+        return f'<a href="{href}">{match[2]}</a>'
 
-    for url in urls:
-        if url not in text:
-            if first_link:
-                text = f'<a href="{url}"> </a>{text}\n\n{url}' if text else url
-                first_link = False
-            else:
-                text += f"\n{url}"
-    return text
+    text = prepare_text_for_html(text)
+    for url in URL_PATTERN.findall(text):
+        url = url.replace("&amp;", "&")
+        known_urls.add(url.rstrip(URL_TRAILING_CHARS))
+    return VK_LINK_PATTERN.sub(render_link, text), known_urls
 
 
-def split_text(text: str, fragment_size: int) -> list:
-    """Splits text into fragments to fit the maximum Telegram message length.
+def add_urls_to_text(text: str, urls: list, videos: list, known_urls: set[str]) -> str:
+    """Adds URLs to the text.
 
     Args:
-        text (str): Text to split.
-        fragment_size (int): Size of the fragment.
+        text (str): Text to add URLs to.
+        urls (list): List of URLs.
+        videos (list): List of URLs to videos.
+        known_urls (set[str]): URLs the text already contains, the added URLs are put there too.
 
     Returns:
-        list: List of fragments.
+        str: Text with URLs.
     """
-    fragments = []
-    for fragment in range(0, len(text), fragment_size):
-        fragments.append(text[fragment : fragment + fragment_size])
-    return fragments
-
-
-def reformat_vk_links(text: str) -> str:
-    """Reformats VK links to Telegram links."""
-    match = re.search(r"\[([\w.:/]+?)\|(.+?)\]", text)
-    while match:
-        left_text = text[: match.span()[0]]
-        right_text = text[match.span()[1] :]
-        matching_text = text[match.span()[0] : match.span()[1]]
-
-        link_domain, link_text = re.findall(r"\[(.+?)\|(.+?)\]", matching_text)[0]
-        text = (
-            left_text +
-            f"""<a href="{f'https://vk.com/{link_domain}'}">{link_text}</a>"""
-            + right_text
-        )
-        match = re.search(r"\[([\w.:/]+?)\|(.+?)\]", text)
+    new_urls = []
+    for url in videos + urls:
+        if url not in known_urls:
+            known_urls.add(url)
+            new_urls.append(url)
+
+    if not new_urls:
+        return text
+    if not text:
+        return "\n".join(new_urls)
+    return f'<a href="{new_urls[0]}"> </a>{text}\n\n' + "\n".join(new_urls)
 
-    return text
 
 def slug_filename(filename: str) -> str:
     """
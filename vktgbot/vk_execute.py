@@ -0,0 +1,131 @@
+import asyncio
+import json
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+
+MAX_EXECUTE_CALLS = 25
+
+
+class ExecuteCoalescer:
+    """Coalesces VK API calls issued in the same event loop iteration
+    into batches run by the `execute` method.
+
+    Every caller still receives its own response dict shaped like a response
+    of a direct call: `{"response": ...}` or `{"error": {...}}`.
+
+    Args:
+        send (Callable[[str, dict], Awaitable[dict]]): Coroutine that performs
+            a single VK API request and returns the decoded response.
+        max_calls (int, optional): Maximum number of calls in one batch.
+            Defaults to 25, the limit of the `execute` method.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str, dict], Awaitable[dict]],
+        max_calls: int = MAX_EXECUTE_CALLS
+    ):
+        self.send = send
+        self.max_calls = min(max_calls, MAX_EXECUTE_CALLS)
+        self._pending: dict[tuple[str, str], list[tuple[str, dict, asyncio.Future]]] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def call(self, method: str, params: dict) -> dict:
+        """Queues the call and waits for the batch it was put in.
+
+        Args:
+            method (str): Name of the VK API method.
+            params (dict): Parameters of the request including `access_token` and `v`.
+
+        Returns:
+            dict: Decoded response of the call.
+        """
+        params = dict(params)
+        key = (params.pop("access_token"), str(params.pop("v")))
+        future = asyncio.get_running_loop().create_future()
+
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = []
+            self._schedule(key, batch)
+        batch.append((method, params, future))
+        if len(batch) >= self.max_calls:
+            del self._pending[key]
+
+        return await future
+
+    def _schedule(self, key: tuple[str, str], batch: list) -> None:
+        # The task starts after the callbacks already scheduled for the current
+        # loop iteration, so calls from concurrently started coroutines join the batch.
+        task = asyncio.get_running_loop().create_task(self._flush(key, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, key: tuple[str, str], batch: list) -> None:
+        if self._pending.get(key) is batch:
+            del self._pending[key]
+        vk_token, req_version = key
+        try:
+            if len(batch) == 1:
+                method, params, future = batch[0]
+                result = await self.send(
+                    method,
+                    dict(params, access_token=vk_token, v=req_version)
+                )
+                if not future.done():
+                    future.set_result(result)
+                return
+
+            code = "return [{}];".format(
+                ",".join(
+                    f"API.{method}({json.dumps(params, ensure_ascii=False)})"
+                    for method, params, _ in batch
+                )
+            )
+            logger.debug(f"Running {len(batch)} VK API calls with one execute request.")
+            data = await self.send(
+                "execute",
+                {"access_token": vk_token, "v": req_version, "code": code}
+            )
+            results = split_execute_response(data, len(batch))
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as ex:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(ex)
+
+
+def split_execute_response(data: dict, calls_count: int) -> list[dict]:
+    """Splits the response of the `execute` method into responses of separate calls.
+
+    Failed calls are returned as `false` or `null` in the response list, and
+    their errors are listed in `execute_errors` in the same order.
+
+    Args:
+        data (dict): Decoded response of the `execute` method.
+        calls_count (int): Number of calls in the batch.
+
+    Returns:
+        list[dict]: Responses of the calls in the order of the batch.
+    """
+    if "response" not in data:
+        return [data] * calls_count
+
+    errors = iter(data.get("execute_errors", []))
+    results = []
+    for response in data["response"]:
+        if response is False or response is None:
+            results.append(
+                {"error": next(errors, {"error_msg": "Call inside execute failed."})}
+            )
+        else:
+            results.append({"response": response})
+    results.extend(
+        {"error": {"error_msg": "Call is missing in execute response."}}
+        for _ in range(calls_count - len(results))
+    )
+    return results
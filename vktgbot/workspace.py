@@ -0,0 +1,187 @@
+import io
+import itertools
+import os
+import shutil
+from dataclasses import dataclass
+
+from loguru import logger
+
+from config import TEMP_SPOOL_SIZE, TEMP_MEMORY_LIMIT, TEMP_DISK_LIMIT
+import http_session
+
+
+@dataclass(slots=True)
+class StoredFile:
+    """Downloaded file kept in memory (`data`) or on disk (`path`)."""
+
+    name: str
+    size: int
+    data: bytes | None = None
+    path: str | None = None
+
+    def open(self) -> io.BufferedIOBase:
+        """Opens a new reader of the file, so the file can be sent to several channels at once."""
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        return open(self.path, "rb")
+
+
+class TempWorkspace:
+    """Storage of the downloaded media of the posts being handled.
+
+    Every post part gets its own scope, and the files of a scope are removed
+    together once the part is sent. Files of up to `spool_size` bytes are kept
+    in memory while all of them take less than `memory_limit` bytes, the others
+    are written to the folder of the scope. A file that would take the disk
+    usage over `disk_limit` bytes is not stored.
+
+    Args:
+        spool_size (int): Maximum size of a file kept in memory.
+        memory_limit (int): Maximum size of all files kept in memory.
+        disk_limit (int): Maximum size of all files on disk, 0 for no limit.
+    """
+
+    def __init__(self, spool_size: int, memory_limit: int, disk_limit: int):
+        self.spool_size = spool_size
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self.memory_used = 0
+        self.disk_used = 0
+        self._scopes: dict[str, "TempScope"] = {}
+
+    def scope(self, path: str) -> "TempScope":
+        """Opens the scope of a post part. Its folder is created only if a file goes to disk.
+
+        Args:
+            path (str): Folder of the scope, unique for the post part.
+        """
+        scope = self._scopes[path] = TempScope(self, path)
+        return scope
+
+    def reserve(self, size: int) -> str | None:
+        """Takes the space for a file of the size.
+
+        Returns:
+            str | None: "memory" or "disk", or None if there is no space for the file.
+        """
+        if size <= self.spool_size and self.memory_used + size <= self.memory_limit:
+            self.memory_used += size
+            return "memory"
+        if not self.disk_limit or self.disk_used + size <= self.disk_limit:
+            self.disk_used += size
+            return "disk"
+        return None
+
+    def release(self, stored: StoredFile) -> None:
+        """Gives back the space taken by the file."""
+        if stored.path is not None:
+            self.disk_used -= stored.size
+        else:
+            self.memory_used -= stored.size
+
+    def discard(self, scope: "TempScope") -> None:
+        if self._scopes.get(scope.path) is scope:
+            del self._scopes[scope.path]
+
+    def sweep(self, folder: str) -> None:
+        """Closes the scopes in the folder and removes anything left in it.
+
+        Must be called only when no post with files in the folder is being handled,
+        after an interrupted or failed pass.
+
+        Args:
+            folder (str): Temp folder of a source.
+        """
+        for path, scope in list(self._scopes.items()):
+            if os.path.dirname(path) == folder:
+                scope.close()
+        if not os.path.isdir(folder):
+            return
+        for entry in os.scandir(folder):
+            logger.debug(f"Removing '{entry.path}' left in the temp folder.")
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                remove_file(entry.path)
+
+
+class TempScope:
+    """Files of one post part in the temp workspace.
+
+    Args:
+        workspace (TempWorkspace): Workspace of the scope.
+        path (str): Folder for the files of the scope that are written to disk.
+    """
+
+    def __init__(self, workspace: TempWorkspace, path: str):
+        self.workspace = workspace
+        self.path = path
+        self.files: list[StoredFile] = []
+        self.closed = False
+        self._numbers = itertools.count()
+
+    async def download(self, url: str, name: str, size: int) -> StoredFile | None:
+        """Downloads the file to memory or to disk depending on its size.
+
+        Files on disk are prefixed with their number in the scope,
+        so files with the same name do not overwrite each other.
+
+        Args:
+            url (str): URL of the file.
+            name (str): Name of the file.
+            size (int): Expected size of the file.
+
+        Returns:
+            StoredFile | None: Downloaded file, or None if there is no space for it.
+        """
+        place = self.workspace.reserve(size)
+        if place is None:
+            logger.warning(f"The file '{name}' was not downloaded, the temp folder is full.")
+            return None
+
+        stored = StoredFile(name, size)
+        try:
+            if place == "memory":
+                stored.data = await http_session.get_bytes(url)
+            else:
+                stored.path = os.path.join(self.path, f"{next(self._numbers)}_{name}")
+                os.makedirs(self.path, exist_ok=True)
+                await http_session.download(url, stored.path)
+        except BaseException:
+            self._remove(stored)
+            raise
+
+        if self.closed:
+            # The part was dropped while the file was being downloaded.
+            self._remove(stored)
+            return None
+        self.files.append(stored)
+        return stored
+
+    def close(self) -> None:
+        """Removes the files of the scope. Does nothing if the scope is already closed."""
+        if self.closed:
+            return
+        self.closed = True
+        for stored in self.files:
+            self._remove(stored)
+        self.files.clear()
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path, ignore_errors=True)
+        self.workspace.discard(self)
+
+    def _remove(self, stored: StoredFile) -> None:
+        self.workspace.release(stored)
+        if stored.path is not None:
+            remove_file(stored.path)
+        stored.data = None
+
+
+def remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+temp_workspace = TempWorkspace(TEMP_SPOOL_SIZE, TEMP_MEMORY_LIMIT, TEMP_DISK_LIMIT)